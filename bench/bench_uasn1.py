@@ -0,0 +1,942 @@
+#
+# This file is part of uASN1. uASN1 is free software that is
+# made available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# uASN1 is copyright (c) 2007-2021 by the uASN1 authors. See the
+# file "AUTHORS" for a complete overview.
+
+"""Micro benchmarks for uASN1.
+
+Run with the `lib` directory on the Python path (see env.py), e.g.:
+
+    python bench/bench_uasn1.py            # run all benchmarks
+    python bench/bench_uasn1.py depth      # run selected benchmarks
+"""
+
+import io
+import sys
+import time
+import optparse
+import tracemalloc
+
+import uasn1
+
+
+benchmarks = []
+
+
+def benchmark(func):
+    """Register a benchmark function."""
+    benchmarks.append(func)
+    return func
+
+
+def measure(func, number=None, repeat=5):
+    """Return the best time per call of `func`, in seconds."""
+    if number is None:
+        number = 1
+        while True:
+            start = time.perf_counter()
+            for i in range(number):
+                func()
+            if time.perf_counter() - start > 0.05:
+                break
+            number *= 4
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        for j in range(number):
+            func()
+        elapsed = (time.perf_counter() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def peak_memory(func):
+    """Return the peak number of bytes allocated during a call of `func`."""
+    tracemalloc.start()
+    try:
+        func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def report(name, seconds, extra=''):
+    """Print one result line."""
+    print('  %-44s %12.2f us %s' % (name, seconds * 1e6, extra))
+
+
+def nested(depth, payload):
+    """Return `payload` as an octet string wrapped in `depth` sequences."""
+    enc = uasn1.Encoder()
+    enc.start()
+    for i in range(depth):
+        enc.enter(uasn1.Sequence)
+    enc.write(payload, uasn1.OctetString)
+    for i in range(depth):
+        enc.leave()
+    return enc.output()
+
+
+def crl(count):
+    """Return a CRL-like document with `count` revoked certificates."""
+    enc = uasn1.Encoder()
+    enc.start()
+    enc.enter(uasn1.Sequence)
+    enc.enter(uasn1.Sequence)
+    enc.write('1.2.840.113549.1.1.11', uasn1.ObjectIdentifier)
+    enc.enter(uasn1.Sequence)
+    for i in range(count):
+        enc.enter(uasn1.Sequence)
+        enc.write(0x100000000000 + i)
+        enc.write(b'211231235959Z', 0x17)
+        enc.enter(uasn1.Sequence)
+        enc.enter(uasn1.Sequence)
+        enc.write('2.5.29.21', uasn1.ObjectIdentifier)
+        enc.write(b'\x0a\x01\x01', uasn1.OctetString)
+        enc.leave()
+        enc.leave()
+        enc.leave()
+    enc.leave()
+    enc.leave()
+    enc.write(b'\x00' * 256, 0x03)
+    enc.leave()
+    return enc.output()
+
+
+def walk(dec):
+    """Read all values of a started decoder with the method-call API."""
+    while not dec.eof():
+        tag = dec.peek()
+        if tag[1] == uasn1.TypeConstructed:
+            dec.enter()
+            walk(dec)
+            dec.leave()
+        else:
+            dec.read()
+
+
+@benchmark
+def depth():
+    """Decoder: walk to a 64 KiB octet string at increasing depth."""
+    payload = b'x' * 65536
+    for view in (False, True):
+        for level in (1, 4, 16, 64):
+            data = nested(level, payload)
+
+            def walk():
+                dec = uasn1.Decoder()
+                dec.start(data, view=view)
+                for i in range(level):
+                    dec.enter()
+                dec.read()
+            name = 'depth=%d view=%s' % (level, view)
+            report(name, measure(walk), '(peak %d bytes)' % peak_memory(walk))
+
+
+@benchmark
+def sequence_of():
+    """Encoder: SEQUENCE OF n CRL-like entries, per entry cost."""
+    for count in (1000, 10000, 100000):
+
+        def encode():
+            enc = uasn1.Encoder()
+            enc.start()
+            enc.enter(uasn1.Sequence)
+            for i in range(count):
+                enc.enter(uasn1.Sequence)
+                enc.write(0x1000000 + i)
+                enc.write(b'20211231235959Z', 0x18)
+                enc.leave()
+            enc.leave()
+            return enc.output()
+        seconds = measure(encode, number=1)
+        report('entries=%d' % count, seconds / count, 'per entry')
+
+
+@benchmark
+def index():
+    """Index: header-only scan of a CRL vs a full Decoder walk."""
+    data = crl(50000)
+
+    def decode():
+        dec = uasn1.Decoder()
+        dec.start(data, view=True)
+        walk(dec)
+
+    def scan():
+        return uasn1.Index(data, view=True)
+    size = '(%d bytes)' % len(data)
+    report('Decoder walk', measure(decode, number=1), size)
+    report('Index scan', measure(scan, number=1), size)
+    idx = scan()
+    node = len(idx) - 3
+    report('Index read (random node)', measure(lambda: idx.read(node)))
+
+
+@benchmark
+def select():
+    """Decoder: select() a field vs enter()/read() to reach it."""
+    data = crl(1000)
+    path = uasn1.Path((0, 0, 1, 999, 0))
+
+    def manual():
+        dec = uasn1.Decoder()
+        dec.start(data)
+        dec.enter()
+        dec.enter()
+        dec.read()
+        dec.enter()
+        for i in range(999):
+            dec.read()
+        dec.enter()
+        return dec.read()
+
+    def selected():
+        dec = uasn1.Decoder()
+        dec.start(data)
+        return dec.select(path)
+    assert manual() == selected()
+    report('enter/read, entry 1000 of 1000', measure(manual))
+    report('select, entry 1000 of 1000', measure(selected))
+
+
+@benchmark
+def skip():
+    """Decoder: skip()/read_raw() vs read() and enter()/leave()."""
+    data = crl(1000)
+
+    def entries(func):
+        dec = uasn1.Decoder()
+        dec.start(data, view=True)
+        dec.enter()
+        dec.enter()
+        dec.read()
+        dec.enter()
+        while not dec.eof():
+            func(dec)
+
+    def enter_leave(dec):
+        dec.enter()
+        dec.leave()
+
+    def forward(dec):
+        out.write(dec.read_raw())
+    out = io.BytesIO()
+    report('1000 entries, enter/leave', measure(lambda: entries(enter_leave)))
+    report('1000 entries, skip', measure(lambda: entries(uasn1.Decoder.skip)))
+    report('1000 entries, read_raw', measure(lambda: entries(forward)))
+    data = b''.join([b'\x02\x08\x7f' + b'\xff' * 7] * 1000)
+
+    def values(func):
+        dec = uasn1.Decoder()
+        dec.start(data)
+        while not dec.eof():
+            func(dec)
+    report('1000 integers, read', measure(lambda: values(uasn1.Decoder.read)))
+    report('1000 integers, skip', measure(lambda: values(uasn1.Decoder.skip)))
+
+
+@benchmark
+def integer():
+    """Codecs: INTEGER and OID encode/decode, native vs fallback code."""
+    saved = uasn1._fast_int
+    try:
+        for size in (8, 64, 512, 4096):
+            value = -(1 << (size * 8 - 9)) - 12345
+            data = uasn1._encode_integer(value)
+            for fast in (True, False):
+                uasn1._fast_int = fast
+                name = '%d byte integer, fast=%s' % (size, fast)
+                report(name + ' encode',
+                       measure(lambda: uasn1._encode_integer(value)))
+                report(name + ' decode',
+                       measure(lambda: uasn1._decode_integer(data)))
+    finally:
+        uasn1._fast_int = saved
+    for oid in ('2.5.4.3', '1.2.840.113549.1.1.11',
+                '2.25.329800735698586629295641978511506172918'):
+        data = uasn1._encode_object_identifier(oid)
+        report('oid %s encode' % oid[:24],
+               measure(lambda: uasn1._encode_object_identifier(oid)))
+        report('oid %s decode' % oid[:24],
+               measure(lambda: uasn1._decode_object_identifier(data)))
+
+
+@benchmark
+def oid_cache():
+    """Codecs: OID encode/decode through the cache vs uncached."""
+    enc = uasn1.Encoder()
+    dec = uasn1.Decoder()
+    oid = '1.2.840.113549.1.1.11'
+    data = b'\x06\x09\x2a\x86\x48\x86\xf7\x0d\x01\x01\x0b'
+
+    def encode():
+        enc.start()
+        enc.write(oid, uasn1.ObjectIdentifier)
+
+    def decode():
+        dec.start(data)
+        dec.read()
+    maxsize = uasn1.oid_cache.info()[3]
+    try:
+        for size in (maxsize, 0):
+            uasn1.oid_cache.resize(size)
+            report('write, cache size %d' % size, measure(encode))
+            report('read, cache size %d' % size, measure(decode))
+    finally:
+        uasn1.oid_cache.resize(maxsize)
+        uasn1.oid_cache.preload(uasn1._well_known_oids)
+
+
+snmp_binding = ('sequence', [
+    ('name', uasn1.ObjectIdentifier),
+    ('value', 'any')])
+snmp_pdu = ('sequence', [
+    ('version', uasn1.Integer),
+    ('community', uasn1.OctetString),
+    ('data', ('implicit', 0, ('sequence', [
+        ('request-id', uasn1.Integer),
+        ('error-status', uasn1.Integer),
+        ('error-index', uasn1.Integer),
+        ('variable-bindings', ('sequence of', snmp_binding))])))])
+ldap_filter = ('choice', [
+    ('equalityMatch', ('implicit', 3, ('sequence', [
+        ('attributeDesc', uasn1.OctetString),
+        ('assertionValue', uasn1.OctetString)]))),
+    ('present', ('implicit', 7, uasn1.OctetString))])
+ldap_search = ('sequence', [
+    ('messageID', uasn1.Integer),
+    ('protocolOp', ('implicit', (3, uasn1.ClassApplication), ('sequence', [
+        ('baseObject', uasn1.OctetString),
+        ('scope', uasn1.Enumerated),
+        ('derefAliases', uasn1.Enumerated),
+        ('sizeLimit', uasn1.Integer),
+        ('timeLimit', uasn1.Integer),
+        ('typesOnly', uasn1.Boolean),
+        ('filter', ldap_filter),
+        ('attributes', ('sequence of', uasn1.OctetString))])))])
+
+
+def snmp_manual_encode(value):
+    """Encode an SNMP GetRequest with the Encoder API."""
+    enc = uasn1.Encoder()
+    enc.start()
+    enc.enter(uasn1.Sequence)
+    enc.write(value['version'])
+    enc.write(value['community'])
+    data = value['data']
+    enc.enter(0, uasn1.ClassContext)
+    enc.write(data['request-id'])
+    enc.write(data['error-status'])
+    enc.write(data['error-index'])
+    enc.enter(uasn1.Sequence)
+    for binding in data['variable-bindings']:
+        enc.enter(uasn1.Sequence)
+        enc.write(binding['name'], uasn1.ObjectIdentifier)
+        enc.write(None)
+        enc.leave()
+    enc.leave()
+    enc.leave()
+    enc.leave()
+    return enc.output()
+
+
+def snmp_manual_decode(data):
+    """Decode an SNMP GetRequest with the Decoder API."""
+    dec = uasn1.Decoder()
+    dec.start(data)
+    dec.enter()
+    value = {'version': dec.read()[1], 'community': dec.read()[1]}
+    dec.enter()
+    pdu = {'request-id': dec.read()[1], 'error-status': dec.read()[1],
+           'error-index': dec.read()[1]}
+    dec.enter()
+    bindings = []
+    while not dec.eof():
+        dec.enter()
+        bindings.append({'name': dec.read()[1], 'value': dec.read_raw()})
+        dec.leave()
+    dec.leave()
+    pdu['variable-bindings'] = bindings
+    dec.leave()
+    value['data'] = pdu
+    dec.leave()
+    return value
+
+
+def ldap_manual_encode(value):
+    """Encode an LDAP SearchRequest with the Encoder API."""
+    enc = uasn1.Encoder()
+    enc.start()
+    enc.enter(uasn1.Sequence)
+    enc.write(value['messageID'])
+    op = value['protocolOp']
+    enc.enter(3, uasn1.ClassApplication)
+    enc.write(op['baseObject'])
+    enc.write(op['scope'], uasn1.Enumerated)
+    enc.write(op['derefAliases'], uasn1.Enumerated)
+    enc.write(op['sizeLimit'])
+    enc.write(op['timeLimit'])
+    enc.write(op['typesOnly'], uasn1.Boolean)
+    name, match = op['filter']
+    enc.enter(3, uasn1.ClassContext)
+    enc.write(match['attributeDesc'])
+    enc.write(match['assertionValue'])
+    enc.leave()
+    enc.enter(uasn1.Sequence)
+    for attribute in op['attributes']:
+        enc.write(attribute)
+    enc.leave()
+    enc.leave()
+    enc.leave()
+    return enc.output()
+
+
+def ldap_manual_decode(data):
+    """Decode an LDAP SearchRequest with the Decoder API."""
+    dec = uasn1.Decoder()
+    dec.start(data)
+    dec.enter()
+    value = {'messageID': dec.read()[1]}
+    dec.enter()
+    op = {}
+    for name in ('baseObject', 'scope', 'derefAliases', 'sizeLimit',
+                 'timeLimit', 'typesOnly'):
+        op[name] = dec.read()[1]
+    dec.enter()
+    op['filter'] = ('equalityMatch', {'attributeDesc': dec.read()[1],
+                                      'assertionValue': dec.read()[1]})
+    dec.leave()
+    dec.enter()
+    attributes = []
+    while not dec.eof():
+        attributes.append(dec.read()[1])
+    dec.leave()
+    op['attributes'] = attributes
+    dec.leave()
+    value['protocolOp'] = op
+    dec.leave()
+    return value
+
+
+@benchmark
+def schema():
+    """Schema: compiled SNMP and LDAP messages vs the Encoder/Decoder API."""
+    snmp = {'version': 1, 'community': b'public', 'data': {
+        'request-id': 1234567, 'error-status': 0, 'error-index': 0,
+        'variable-bindings': [
+            {'name': '1.3.6.1.2.1.1.%d.0' % i, 'value': b'\x05\x00'}
+            for i in range(1, 6)]}}
+    ldap = {'messageID': 2, 'protocolOp': {
+        'baseObject': b'dc=example,dc=com', 'scope': 2, 'derefAliases': 0,
+        'sizeLimit': 0, 'timeLimit': 30, 'typesOnly': False,
+        'filter': ('equalityMatch', {'attributeDesc': b'uid',
+                                     'assertionValue': b'jdoe'}),
+        'attributes': [b'cn', b'mail', b'uidNumber']}}
+    cases = (('snmp', uasn1.Schema(snmp_pdu), snmp, snmp_manual_encode,
+              snmp_manual_decode),
+             ('ldap', uasn1.Schema(ldap_search), ldap, ldap_manual_encode,
+              ldap_manual_decode))
+    for name, compiled, value, encode, decode in cases:
+        data = compiled.encode(value)
+        assert data == encode(value)
+        assert compiled.decode(data) == decode(data)
+        report('%s encode, manual' % name, measure(lambda: encode(value)))
+        report('%s encode, schema' % name,
+               measure(lambda: compiled.encode(value)))
+        report('%s decode, manual' % name, measure(lambda: decode(data)))
+        report('%s decode, schema' % name,
+               measure(lambda: compiled.decode(data)))
+
+
+def snmp_get_request(obj, request_id, names):
+    """Record an SNMP GetRequest on an Encoder or Template."""
+    obj.enter(uasn1.Sequence)
+    obj.write(1)
+    obj.write(b'public')
+    obj.enter(0, uasn1.ClassContext)
+    request_id(obj)
+    obj.write(0)
+    obj.write(0)
+    obj.enter(uasn1.Sequence)
+    for name in names:
+        obj.enter(uasn1.Sequence)
+        name(obj)
+        obj.write(None)
+        obj.leave()
+    obj.leave()
+    obj.leave()
+    obj.leave()
+
+
+@benchmark
+def template():
+    """Template: fill an SNMP GetRequest vs a full Encoder pass."""
+    oids = ['1.3.6.1.2.1.1.%d.0' % i for i in range(1, 6)]
+    constant = [lambda obj, oid=oid: obj.write(oid, uasn1.ObjectIdentifier)
+                for oid in oids]
+    tmpl = uasn1.Template()
+    snmp_get_request(tmpl, lambda obj: obj.slot('id', uasn1.Integer),
+                     constant)
+    varying = uasn1.Template()
+    snmp_get_request(varying, lambda obj: obj.slot('id', uasn1.Integer),
+                     [lambda obj, i=i: obj.slot(i, uasn1.ObjectIdentifier)
+                      for i in range(len(oids))])
+    values = dict(enumerate(oids))
+    values['id'] = 1234567
+
+    def encode():
+        enc = uasn1.Encoder()
+        enc.start()
+        snmp_get_request(enc, lambda obj: obj.write(1234567), constant)
+        return enc.output()
+    assert encode() == tmpl.fill(values) == varying.fill(values)
+    report('Encoder', measure(encode))
+    report('Template, request-id slot', measure(lambda: tmpl.fill(values)))
+    report('Template, request-id and 5 oid slots',
+           measure(lambda: varying.fill(values)))
+
+
+class NullSink(object):
+    """A sink that discards its input."""
+
+    def write(self, data):
+        return len(data)
+
+
+def export(enc, count):
+    """Encode a CRL-like export of `count` entries with `enc`."""
+    enc.start()
+    enc.enter(uasn1.Sequence)
+    enc.write('1.2.840.113549.1.1.11', uasn1.ObjectIdentifier)
+    enc.enter(uasn1.Sequence)
+    for i in range(count):
+        enc.enter(uasn1.Sequence)
+        enc.write(0x100000000000 + i)
+        enc.write(b'20211231235959Z', 0x18)
+        enc.leave()
+    enc.leave()
+    enc.leave()
+
+
+@benchmark
+def stream_encoder():
+    """StreamEncoder: peak memory and time of an export vs Encoder."""
+    for count in (10000, 100000):
+
+        def memory():
+            enc = uasn1.Encoder()
+            export(enc, count)
+            return enc.output()
+
+        def indefinite():
+            enc = uasn1.StreamEncoder(NullSink())
+            export(enc, count)
+            enc.close()
+
+        def two_pass():
+            enc = uasn1.StreamEncoder(None)
+            export(enc, count)
+            enc.close()
+            enc = uasn1.StreamEncoder(NullSink(), enc.lengths()[0])
+            export(enc, count)
+            enc.close()
+        for name, func in (('Encoder', memory), ('indefinite', indefinite),
+                           ('two-pass DER', two_pass)):
+            report('%d entries, %s' % (count, name),
+                   measure(func, number=1, repeat=3),
+                   '(peak %d bytes)' % peak_memory(func))
+
+
+@benchmark
+def indefinite():
+    """Decoder: walk and skip an indefinite length export vs DER."""
+    out = io.BytesIO()
+    enc = uasn1.StreamEncoder(out)
+    export(enc, 10000)
+    enc.close()
+    enc = uasn1.Encoder()
+    export(enc, 10000)
+    for name, data in (('DER', enc.output()), ('indefinite', out.getvalue())):
+
+        def decode():
+            dec = uasn1.Decoder()
+            dec.start(data, view=True)
+            walk(dec)
+
+        def skip():
+            dec = uasn1.Decoder()
+            dec.start(data, view=True)
+            dec.enter()
+            dec.skip()
+            dec.enter()
+            while not dec.eof():
+                dec.skip()
+        report('walk, %s' % name, measure(decode, number=1))
+        report('skip entries, %s' % name, measure(skip, number=1))
+    segment = b'\x04\x82\x04\x00' + b'x' * 1024
+    data = b'\x24\x80' + segment * 64 + b'\x00\x00'
+    dec = uasn1.Decoder()
+
+    def segments():
+        dec.start(data)
+        return dec.read()
+    report('64 segments of 1 KiB, read', measure(segments))
+
+
+@benchmark
+def mmap():
+    """Decoder: select the last entry of a CRL file, read vs open()."""
+    import os
+    import tempfile
+    fd, path = tempfile.mkstemp()
+    try:
+        with open(fd, 'wb') as fobj:
+            fobj.write(crl(50000))
+        target = uasn1.Path((0, 0, 1, 49999, 0))
+
+        def read():
+            with open(path, 'rb') as fobj:
+                data = fobj.read()
+            dec = uasn1.Decoder()
+            dec.start(data, view=True)
+            return dec.select(target)
+
+        def mapped():
+            dec = uasn1.Decoder()
+            dec.open(path)
+            value = dec.select(target)
+            dec.close()
+            return value
+        assert read() == mapped()
+        size = '(%d byte file)' % os.path.getsize(path)
+        for name, func in (('read()', read), ('open()', mapped)):
+            report('%s, select' % name, measure(func),
+                   '(peak %d bytes) %s' % (peak_memory(func), size))
+    finally:
+        os.unlink(path)
+
+
+@benchmark
+def record_file():
+    """RecordFile: index build, reopen and random access vs skipping."""
+    import os
+    import shutil
+    import tempfile
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'records')
+        record = crl(1)
+        count = 100000
+        with open(path, 'wb') as fobj:
+            fobj.write(record * count)
+
+        def build():
+            os.unlink(path + '.idx')
+            uasn1.RecordFile(path).close()
+        uasn1.RecordFile(path).close()
+        report('index %d records' % count, measure(build, number=1),
+               '(%d byte file)' % os.path.getsize(path))
+        report('reopen with index',
+               measure(lambda: uasn1.RecordFile(path).close()))
+        records = uasn1.RecordFile(path)
+        number = count - 1
+        report('raw(%d), index' % number,
+               measure(lambda: records.raw(number)))
+        records.close()
+        dec = uasn1.Decoder()
+
+        def skip():
+            dec.open(path)
+            for i in range(number):
+                dec.skip()
+            value = dec.read_raw()
+            del value
+            dec.close()
+        report('record %d, skip' % number, measure(skip, number=1))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@benchmark
+def limits():
+    """Decoder: walk a CRL with and without limits, reject hostile input."""
+    data = crl(10000)
+    limits = {'max_length': 1 << 24, 'max_depth': 32,
+              'max_elements': 1 << 17, 'max_integer': 64, 'max_arc': 8}
+    for name, kwargs in (('no limits', {}), ('all limits', limits)):
+
+        def decode():
+            dec = uasn1.Decoder(**kwargs)
+            dec.start(data, view=True)
+            walk(dec)
+        report('walk, %s' % name, measure(decode, number=1))
+    hostile = (('deep nesting', b'\x30\x80' * 100000),
+               ('many elements', b'\x05\x00' * 1000000),
+               ('large integer', b'\x02\x83\x01\x00\x00\x01' +
+                b'\x00' * 65535),
+               ('large arc', b'\x06\x83\x01\x00\x00' + b'\xff' * 65535 +
+                b'\x01'),
+               ('large real', b'\x09\x83\x03\x0d\x42\x80\x00' +
+                b'\x01' * 200000))
+    for name, hostile_data in hostile:
+
+        def reject():
+            dec = uasn1.Decoder(**limits)
+            dec.start(hostile_data, view=True)
+            try:
+                walk(dec)
+            except uasn1.Error:
+                pass
+        report('reject %s' % name, measure(reject),
+               '(%d bytes)' % len(hostile_data))
+
+
+@benchmark
+def events():
+    """Decoder: events() vs the peek/enter/read/leave walk, per TLV."""
+    data = crl(10000)
+    count = len(uasn1.Index(data))
+
+    def decode():
+        dec = uasn1.Decoder()
+        dec.start(data, view=True)
+        walk(dec)
+
+    def generate():
+        dec = uasn1.Decoder()
+        dec.start(data, view=True)
+        for event in dec.events():
+            pass
+    report('walk', measure(decode, number=1) / count, 'per TLV')
+    report('events', measure(generate, number=1) / count, 'per TLV')
+
+
+@benchmark
+def statistics():
+    """Decoder: statistics() vs counting events(), per TLV."""
+    data = crl(10000)
+    count = len(uasn1.Index(data))
+
+    def generate():
+        dec = uasn1.Decoder()
+        dec.start(data, view=True)
+        tags = {}
+        for event in dec.events():
+            tags[event[1]] = tags.get(event[1], 0) + 1
+
+    def scan():
+        dec = uasn1.Decoder()
+        dec.start(data, view=True)
+        dec.statistics()
+    report('events', measure(generate, number=1) / count, 'per TLV')
+    report('statistics', measure(scan, number=1) / count,
+           'per TLV (peak %d bytes for %d bytes)' %
+           (peak_memory(scan), len(data)))
+
+
+def certificate():
+    """Return the DER encoding of examples/test.crt."""
+    import os
+    import base64
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', 'examples', 'test.crt')
+    with open(path) as fobj:
+        lines = [line.strip() for line in fobj if not line.startswith('-')]
+    return base64.b64decode(''.join(lines))
+
+
+def tree(dec):
+    """Decode all values of a started decoder into nested lists."""
+    result = []
+    while not dec.eof():
+        tag = dec.peek()
+        if tag[1] == uasn1.TypeConstructed:
+            dec.enter()
+            result.append((tag, tree(dec)))
+            dec.leave()
+        else:
+            result.append(dec.read())
+    return result
+
+
+@benchmark
+def decode_all():
+    """decode_all() vs a Decoder walk into the same nested lists."""
+    ldap = uasn1.Schema(ldap_search).encode({
+        'messageID': 2, 'protocolOp': {
+            'baseObject': b'dc=example,dc=com', 'scope': 2,
+            'derefAliases': 0, 'sizeLimit': 0, 'timeLimit': 30,
+            'typesOnly': False,
+            'filter': ('equalityMatch', {'attributeDesc': b'uid',
+                                         'assertionValue': b'jdoe'}),
+            'attributes': [b'cn', b'mail', b'uidNumber']}})
+    for name, data in (('certificate', certificate()),
+                       ('LDAP SearchRequest', ldap), ('CRL', crl(1000))):
+
+        def walk_tree():
+            dec = uasn1.Decoder()
+            dec.start(data)
+            return tree(dec)
+        assert walk_tree() == uasn1.decode_all(data)
+        report('%s, Decoder' % name, measure(walk_tree))
+        report('%s, decode_all' % name,
+               measure(lambda: uasn1.decode_all(data)))
+
+
+@benchmark
+def write_raw():
+    """Encoder: embed a certificate with write_raw() vs re-encoding it."""
+    data = certificate()
+    cert = uasn1.decode(data)
+
+    def reencode():
+        enc = uasn1.Encoder()
+        enc.start()
+        enc.enter(uasn1.Sequence)
+        enc.write(1)
+        enc.write_raw(uasn1.encode([uasn1.decode(data)]))
+        enc.leave()
+        return enc.output()
+
+    def splice():
+        enc = uasn1.Encoder()
+        enc.start()
+        enc.enter(uasn1.Sequence)
+        enc.write(1)
+        enc.write_raw(data)
+        enc.leave()
+        return enc.output()
+    assert reencode() == splice()
+    report('decode and encode', measure(reencode))
+    report('encode only', measure(lambda: uasn1.encode([cert])))
+    report('write_raw', measure(splice))
+
+
+@benchmark
+def patch():
+    """patch() of an LDAP messageID vs decoding and encoding again."""
+    schema = uasn1.Schema(ldap_search)
+    value = {
+        'messageID': 2, 'protocolOp': {
+            'baseObject': b'dc=example,dc=com', 'scope': 2,
+            'derefAliases': 0, 'sizeLimit': 0, 'timeLimit': 30,
+            'typesOnly': False,
+            'filter': ('equalityMatch', {'attributeDesc': b'uid',
+                                         'assertionValue': b'jdoe'}),
+            'attributes': [b'cn', b'mail', b'uidNumber']}}
+    data = schema.encode(value)
+    path = uasn1.Path([0, 0])
+
+    def reencode():
+        message = schema.decode(data)
+        message['messageID'] = 1000
+        return schema.encode(message)
+
+    def tree():
+        items = uasn1.decode_all(data)
+        items[0][1][0] = (items[0][1][0][0], 1000)
+        return uasn1.encode(items)
+    buf = bytearray(data)
+    assert reencode() == tree() == uasn1.patch(data, path, 1000)
+    report('Schema decode and encode', measure(reencode))
+    report('decode_all() and encode()', measure(tree))
+    report('patch(), bytes', measure(lambda: uasn1.patch(data, path, 1000)))
+    report('patch(), bytearray in place',
+           measure(lambda: uasn1.patch(buf, path, 1000)))
+
+
+@benchmark
+def threads():
+    """decode()/encode() throughput with a ThreadPoolExecutor."""
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print('  (GIL %s, %d CPUs)' % (gil and 'enabled' or 'disabled',
+                                  os.cpu_count() or 1))
+    data = memoryview(certificate())
+    count = 400
+    chunks = [data] * count
+
+    def work(data):
+        return uasn1.encode([uasn1.decode(data, view=True)])
+    for workers in (1, 2, 4, 8):
+        with ThreadPoolExecutor(workers) as pool:
+            def run():
+                list(pool.map(work, chunks, chunksize=count // workers))
+            seconds = measure(run, number=1, repeat=3)
+        report('%d threads' % workers, seconds / count,
+               'per certificate (%.0f/s)' % (count / seconds))
+
+
+def read_pem_lines(fobj):
+    """Read a PEM bundle by joining the base64 lines of every block."""
+    import base64
+    lines = None
+    for line in fobj:
+        if line.startswith(b'-----BEGIN'):
+            lines = []
+        elif line.startswith(b'-----END'):
+            yield base64.b64decode(b''.join(lines))
+        elif lines is not None:
+            lines.append(line)
+
+
+@benchmark
+def pem():
+    """read_pem() vs joining base64 lines, on a 100k certificate bundle."""
+    import os
+    import tempfile
+    data = certificate()
+    count = 100000
+    fd, path = tempfile.mkstemp()
+    try:
+        with open(fd, 'wb') as fobj:
+            for i in range(count):
+                uasn1.write_pem(fobj, 'CERTIFICATE', data)
+        size = os.path.getsize(path)
+
+        def joined():
+            with open(path, 'rb') as fobj:
+                for der in read_pem_lines(fobj):
+                    dec = uasn1.Decoder()
+                    dec.start(der)
+                    dec.peek()
+
+        def streamed():
+            with open(path, 'rb') as fobj:
+                for label, der in uasn1.read_pem(fobj):
+                    dec = uasn1.Decoder()
+                    dec.start(der)
+                    dec.peek()
+        for name, func in (('joined lines', joined), ('read_pem()', streamed)):
+            seconds = measure(func, number=1, repeat=3)
+            report(name, seconds / count, 'per certificate (%.1f MB/s)' %
+                   (size / seconds / 1e6))
+    finally:
+        os.unlink(path)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [benchmark...]')
+    parser.add_option('-l', '--list', dest='list', action='store_true',
+                      help='list the available benchmarks')
+    (opts, args) = parser.parse_args()
+    if opts.list:
+        for func in benchmarks:
+            print('%-16s %s' % (func.__name__, func.__doc__))
+        return
+    for func in benchmarks:
+        if args and func.__name__ not in args:
+            continue
+        print('%s: %s' % (func.__name__, func.__doc__))
+        func()
+
+
+if __name__ == '__main__':
+    main()
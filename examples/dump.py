@@ -6,34 +6,32 @@
 # uASN1 is copyright (c) 2007-2021 by the uASN1 authors. See the
 # file "AUTHORS" for a complete overview.
 
+"""Dump ASN.1 files, directories of files and PEM bundles.
+
+    python dump.py cert.pem                 # dump a PEM file
+    python dump.py -r crl.der               # dump a DER file
+    python dump.py -f json -j 8 /etc/ssl    # JSON lines, 8 processes
+    python dump.py -s capture.ber           # header statistics only
+
+Files are decoded in parallel by a pool of processes, and the results are
+written in input order. Throughput is reported on standard error.
+"""
+
+import io
+import os
 import sys
-import os.path
-import base64
+import json
+import time
+import binascii
+import optparse
 
 import uasn1
-import optparse
 
+_inf = float('inf')
+
+# The number of bytes that are searched for a PEM BEGIN line.
+detect_size = 65536
 
-def read_pem(input_data):
-    """Read PEM formatted input."""
-    data = []
-    state = 0
-    for line in input_data:
-        if state == 0:
-            if line.startswith('-----BEGIN'):
-                state = 1
-        elif state == 1:
-            if line.startswith('-----END'):
-                state = 2
-            else:
-                data.append(line)
-        elif state == 2:
-            break
-    if state != 2:
-        raise ValueError('No PEM encoded input found')
-    data = ''.join(data)
-    data = base64.b64decode(data)
-    return data
 
 def strid(id):
     """Return a string representation of a ASN.1 id."""
@@ -41,24 +39,37 @@ def strid(id):
         s = 'BOOLEAN'
     elif id == uasn1.Integer:
         s = 'INTEGER'
+    elif id == uasn1.BitString:
+        s = 'BIT STRING'
     elif id == uasn1.OctetString:
         s = 'OCTET STRING'
     elif id == uasn1.Null:
         s = 'NULL'
     elif id == uasn1.ObjectIdentifier:
         s = 'OBJECT IDENTIFIER'
+    elif id == uasn1.Real:
+        s = 'REAL'
     elif id == uasn1.Enumerated:
         s = 'ENUMERATED'
+    elif id == uasn1.UTF8String:
+        s = 'UTF8String'
     elif id == uasn1.Sequence:
         s = 'SEQUENCE'
     elif id == uasn1.Set:
         s = 'SET'
-    elif id == uasn1.Null:
-        s = 'NULL'
+    elif id == uasn1.PrintableString:
+        s = 'PrintableString'
+    elif id == uasn1.IA5String:
+        s = 'IA5String'
+    elif id == uasn1.UTCTime:
+        s = 'UTCTime'
+    elif id == uasn1.GeneralizedTime:
+        s = 'GeneralizedTime'
     else:
         s = '%#02x' % id
     return s
- 
+
+
 def strclass(id):
     """Return a string representation of an ASN.1 class."""
     if id == uasn1.ClassUniversal:
@@ -67,72 +78,288 @@ def strclass(id):
         s = 'APPLICATION'
     elif id == uasn1.ClassContext:
         s = 'CONTEXT'
-    elif id == san1.ClassPrivate:
+    elif id == uasn1.ClassPrivate:
         s = 'PRIVATE'
     else:
         raise ValueError('Illegal class: %#02x' % id)
     return s
 
+
 def strtag(tag):
     """Return a string represenation of an ASN.1 tag."""
     return '[%s] %s' % (strid(tag[0]), strclass(tag[2]))
 
+
 def prettyprint(input_data, output, indent=0):
     """Pretty print ASN.1 data."""
-    while not input_data.eof():
-        tag = input_data.peek()
-        if tag[1] == uasn1.TypePrimitive:
-            tag, value = input_data.read()
-            output.write(' ' * indent)
+    for kind, tag, value, depth, offset in input_data.events():
+        if kind == uasn1.EventValue:
+            if isinstance(value, memoryview):
+                value = bytes(value)
+            output.write(' ' * (indent + 2 * depth))
             output.write('[%s] %s (value %s)' %
                          (strclass(tag[2]), strid(tag[0]), repr(value)))
             output.write('\n')
-        elif tag[1] == uasn1.TypeConstructed:
-            output.write(' ' * indent)
+        elif kind == uasn1.EventStart:
+            output.write(' ' * (indent + 2 * depth))
             output.write('[%s] %s:\n' % (strclass(tag[2]), strid(tag[0])))
-            input_data.enter()
-            prettyprint(input_data, output, indent+2)
-            input_data.leave()
-
-
-# Main script
-
-parser = optparse.OptionParser()
-parser.add_option('-p', '--pem', dest='mode', action='store_const',
-                  const='pem', help='PEM encoded input')
-parser.add_option('-r', '--raw', dest='mode', action='store_const',
-                  const='raw', help='raw input')
-parser.add_option('-o', '--output', dest='output',
-                  help='output to FILE instead', metavar='FILE')
-parser.set_default('mode', 'pem')
-(opts, args) = parser.parse_args()
-
-if len(args) == 1:
-    input_data = open(sys.argv[1])
-else:
-    input_data = sys.stdin
-
-if opts.mode == 'pem':
-    input_data = read_pem(input_data)
-else:
-    input_data = input.read()
-
-if opts.output:
-    output = open(opts.output, 'w')
-else:
-    output = sys.stdout
-
-data = []
-for line in input_data:
-    data.append(line)
-if isinstance(data[0], str):
-    data = b''.join(data)
-elif isinstance(data[0], int):
-    data = bytes(data)
-else:
-    print('invalid data')
-
-dec = uasn1.Decoder()
-dec.start(data)
-
-prettyprint(dec, output)
+
+
+def jsonvalue(value):
+    """Return a JSON compatible representation of a decoded value."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return binascii.hexlify(value).decode('ascii')
+    if isinstance(value, tuple):
+        return [jsonvalue(value[0]), value[1]]
+    if isinstance(value, float) and (value != value or
+                                     value in (_inf, -_inf)):
+        return repr(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def jsontree(items):
+    """Return decoded records as JSON compatible [class, nr, value]
+    lists, where the value of a constructed record is a list of its
+    children."""
+    result = []
+    for tag, value in items:
+        if tag[1] == uasn1.TypeConstructed:
+            value = jsontree(value)
+        else:
+            value = jsonvalue(value)
+        result.append([strclass(tag[2]), tag[0], value])
+    return result
+
+
+def detect(head, mode):
+    """Return the input mode of a file starting with `head`. A file is PEM
+    if a line starts with a BEGIN line, which may follow comments as in
+    the CA bundles of many distributions."""
+    if mode == 'auto':
+        if head.lstrip().startswith(b'-----BEGIN ') or \
+                b'\n-----BEGIN ' in head:
+            mode = 'pem'
+        else:
+            mode = 'raw'
+    return mode
+
+
+def records(data, mode):
+    """Generate the records of the input `data` (bytes). PEM blocks are
+    generated as views that are only valid until the next iteration."""
+    if detect(data[:detect_size], mode) == 'pem':
+        for label, der in uasn1.read_pem(io.BytesIO(data)):
+            yield der
+    else:
+        yield data
+
+
+def error(output, format, name, record, err):
+    """Write the decoding error `err` of a file or a record."""
+    if format == 'json':
+        result = {'file': name, 'error': str(err)}
+        if record is not None:
+            result['record'] = record
+        output.write(json.dumps(result))
+        output.write('\n')
+    elif record is None:
+        output.write('%s: error: %s\n' % (name, err))
+    else:
+        output.write('%s, record %d: error: %s\n' % (name, record, err))
+
+
+def dump(name, data, mode, format):
+    """Dump the input `data` from file `name`. Return an (output, records,
+    errors) tuple."""
+    output = io.StringIO()
+    count = errors = 0
+    try:
+        for der in records(data, mode):
+            try:
+                if format == 'json':
+                    tree = jsontree(uasn1.decode_all(der))
+                    output.write(json.dumps({'file': name, 'record': count,
+                                             'tree': tree}))
+                    output.write('\n')
+                else:
+                    output.write('%s, record %d:\n' % (name, count))
+                    dec = uasn1.Decoder()
+                    dec.start(der)
+                    prettyprint(dec, output, 2)
+            except uasn1.Error as err:
+                errors += 1
+                error(output, format, name, count, err)
+            count += 1
+    except uasn1.Error as err:
+        errors += 1
+        error(output, format, name, None, err)
+    return output.getvalue(), count, errors
+
+
+def summary(name, stats, format):
+    """Return the statistics `stats` of file `name` as text."""
+    tags = sorted(stats['tags'].items(), key=lambda item: -item[1][0])
+    if format == 'json':
+        result = {'file': name, 'records': stats['records'],
+                  'depths': stats['depths'],
+                  'tags': [[strclass(tag[2]), tag[0], bool(tag[1])] + entry
+                           for tag, entry in tags],
+                  'largest': [[length, offset, strclass(tag[2]), tag[0]]
+                              for length, offset, tag in stats['largest']]}
+        return json.dumps(result) + '\n'
+    lines = ['%s: %d records, depths %s' %
+             (name, stats['records'],
+              ' '.join(['%d:%d' % item for item in
+                        enumerate(stats['depths'])]))]
+    lines.append('  %10s %14s  tag' % ('count', 'bytes'))
+    for tag, entry in tags:
+        lines.append('  %10d %14d  [%s] %s%s' %
+                     (entry[0], entry[1], strclass(tag[2]), strid(tag[0]),
+                      tag[1] and ' (constructed)' or ''))
+    lines.append('  %10s %14s  tag' % ('length', 'offset'))
+    for length, offset, tag in stats['largest']:
+        lines.append('  %10d %14d  [%s] %s' %
+                     (length, offset, strclass(tag[2]), strid(tag[0])))
+    return '\n'.join(lines) + '\n'
+
+
+def scan(path, data, mode, format):
+    """Collect the statistics of the headers in the file `path`, or in
+    `data` if it is not None. Return an (output, records, errors, bytes)
+    tuple. Raw files are memory mapped, and PEM files are read a block at
+    a time."""
+    dec = uasn1.Decoder()
+    stats = None
+    size = 0
+    try:
+        if data is not None:
+            size = len(data)
+            for der in records(data, mode):
+                dec.start(der, view=True)
+                stats = dec.statistics(stats=stats)
+        else:
+            with open(path, 'rb') as fobj:
+                head = fobj.read(detect_size)
+                size = fobj.seek(0, 2)
+                fobj.seek(0)
+                if detect(head, mode) == 'pem':
+                    for label, der in uasn1.read_pem(fobj):
+                        dec.start(der, view=True)
+                        stats = dec.statistics(stats=stats)
+                else:
+                    dec.open(path)
+                    try:
+                        stats = dec.statistics()
+                    finally:
+                        dec.close()
+    except (uasn1.Error, OSError) as err:
+        output = io.StringIO()
+        error(output, format, path, None, err)
+        return output.getvalue(), 0, 1, size
+    if stats is None:
+        stats = {'records': 0, 'tags': {}, 'depths': [], 'largest': []}
+    return summary(path, stats, format), stats['records'], 0, size
+
+
+def dumpfile(task):
+    """Read and dump the file in `task`, a (path, mode, format, summary)
+    tuple. Return a (output, records, errors, bytes) tuple."""
+    path, mode, format, summary = task
+    if summary:
+        return scan(path, None, mode, format)
+    try:
+        with open(path, 'rb') as fobj:
+            data = fobj.read()
+    except OSError as err:
+        output = io.StringIO()
+        error(output, format, path, None, err)
+        return output.getvalue(), 0, 1, 0
+    return dump(path, data, mode, format) + (len(data),)
+
+
+def paths(args):
+    """Generate the files named by `args`, descending into directories."""
+    for arg in args:
+        if not os.path.isdir(arg):
+            yield arg
+            continue
+        for dirpath, dirnames, filenames in os.walk(arg):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                yield os.path.join(dirpath, filename)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [FILE|DIR...]')
+    parser.add_option('-p', '--pem', dest='mode', action='store_const',
+                      const='pem', help='PEM encoded input')
+    parser.add_option('-r', '--raw', dest='mode', action='store_const',
+                      const='raw', help='raw input')
+    parser.add_option('-f', '--format', dest='format', type='choice',
+                      choices=('text', 'json'),
+                      help='output format: text (default) or json lines')
+    parser.add_option('-j', '--jobs', dest='jobs', type='int',
+                      help='use N processes (default: number of CPUs)',
+                      metavar='N')
+    parser.add_option('-c', '--chunksize', dest='chunksize', type='int',
+                      help='send files to processes in batches of N',
+                      metavar='N')
+    parser.add_option('-s', '--summary', dest='summary', action='store_true',
+                      help='print statistics of the headers only')
+    parser.add_option('-o', '--output', dest='output',
+                      help='output to FILE instead', metavar='FILE')
+    parser.set_default('mode', 'auto')
+    parser.set_default('format', 'text')
+    (opts, args) = parser.parse_args()
+
+    if opts.output:
+        output = open(opts.output, 'w')
+    else:
+        output = sys.stdout
+
+    start = time.time()
+    files = count = errors = size = 0
+    if args:
+        tasks = [(path, opts.mode, opts.format, opts.summary)
+                 for path in paths(args)]
+        jobs = opts.jobs or os.cpu_count() or 1
+        chunksize = opts.chunksize or max(1, len(tasks) // (jobs * 4))
+        if jobs > 1 and len(tasks) > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(jobs)
+            results = pool.imap(dumpfile, tasks, chunksize)
+        else:
+            pool = None
+            results = map(dumpfile, tasks)
+        try:
+            for result in results:
+                output.write(result[0])
+                count += result[1]
+                errors += result[2]
+                size += result[3]
+                files += 1
+        finally:
+            if pool is not None:
+                pool.terminate()
+    else:
+        data = sys.stdin.buffer.read()
+        if opts.summary:
+            result = scan('<stdin>', data, opts.mode, opts.format)
+        else:
+            result = dump('<stdin>', data, opts.mode, opts.format)
+        output.write(result[0])
+        count, errors, size, files = result[1], result[2], len(data), 1
+    output.flush()
+
+    seconds = max(time.time() - start, 1e-6)
+    sys.stderr.write('%d files, %d records, %d errors, %.1f MB in %.2f s '
+                     '(%.0f files/s, %.2f MB/s)\n' %
+                     (files, count, errors, size / 1e6, seconds,
+                      files / seconds, size / 1e6 / seconds))
+    return errors and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
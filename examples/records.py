@@ -0,0 +1,47 @@
+#
+# This file is part of uASN1. uASN1 is free software that is
+# made available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# uASN1 is copyright (c) 2007-2021 by the uASN1 authors. See the
+# file "AUTHORS" for a complete overview.
+
+"""Index a file of back-to-back DER records, and extract records from it.
+
+    python records.py FILE             # index FILE, print the record count
+    python records.py FILE 10 11       # write records 10 and 11 in hex
+    python records.py -o out FILE 10   # write record 10 to out, as DER
+"""
+
+import sys
+import binascii
+import optparse
+
+import uasn1
+
+
+parser = optparse.OptionParser(usage='%prog [options] FILE [RECORD...]')
+parser.add_option('-i', '--index', dest='index',
+                  help='use index FILE instead of FILE.idx', metavar='FILE')
+parser.add_option('-o', '--output', dest='output',
+                  help='write the records to FILE as DER', metavar='FILE')
+(opts, args) = parser.parse_args()
+if not args:
+    parser.error('no record file given')
+
+try:
+    numbers = [int(arg) for arg in args[1:]]
+except ValueError:
+    parser.error('record numbers must be integers')
+
+records = uasn1.RecordFile(args[0], opts.index)
+if not numbers:
+    print('%d records' % len(records))
+elif opts.output:
+    with open(opts.output, 'wb') as output:
+        for number in numbers:
+            output.write(records.raw(number))
+else:
+    for number in numbers:
+        data = binascii.hexlify(records.raw(number)).decode('ascii')
+        sys.stdout.write('%d: %s\n' % (number, data))
@@ -8,12 +8,19 @@
 
 Boolean = 0x01
 Integer = 0x02
+BitString = 0x03
 OctetString = 0x04
 Null = 0x05
 ObjectIdentifier = 0x06
+Real = 0x09
 Enumerated = 0x0a
+UTF8String = 0x0c
 Sequence = 0x10
 Set = 0x11
+PrintableString = 0x13
+IA5String = 0x16
+UTCTime = 0x17
+GeneralizedTime = 0x18
 
 TypeConstructed = 0x20
 TypePrimitive = 0x00
@@ -23,23 +30,730 @@ ClassApplication = 0x40
 ClassContext = 0x80
 ClassPrivate = 0xc0
 
+EventStart = 'start'
+EventValue = 'value'
+EventEnd = 'end'
+
 import re
+import sys
+import math
+import heapq
+import binascii
+from array import array
+
+try:
+    import datetime as _datetime
+except ImportError:
+    _datetime = None
+
+try:
+    import mmap as _mmap
+except ImportError:
+    _mmap = None
+
+
+# Use the native big integer conversions where available. MicroPython
+# builds may lack the `signed` argument or int.bit_length().
+try:
+    _fast_int = int.from_bytes(b'\xff', 'big', signed=True) == -1 and \
+        (-1).to_bytes(1, 'big', signed=True) == b'\xff' and \
+        (255).bit_length() == 8
+except Exception:
+    _fast_int = False
 
 
 class Error(Exception):
     """ASN1 error"""
 
 
+class _PrematureEnd(Error):
+    """The input ended in the middle of a TLV record. The `missing`
+    attribute is the number of bytes that were required but not present."""
+
+    def __init__(self, missing=1):
+        Error.__init__(self, 'Premature end of input.')
+        self.missing = missing
+
+
+# Codecs for primitive values. An encoder takes a Python value and returns
+# the contents octets, a decoder takes the contents octets (bytes or a
+# memoryview) and returns the Python value. Codecs are looked up by (class,
+# number) in the tables at the end of this section, see register().
+
+def _encode_boolean(value):
+    """Encode a boolean."""
+    return value and b'\xff' or b'\x00'
+
+
+def _decode_boolean(bytes_data):
+    """Decode a boolean value."""
+    if len(bytes_data) != 1:
+        raise Error('ASN1 syntax error')
+    if bytes_data[0] == 0:
+        return False
+    return True
+
+
+def _encode_integer(value):
+    """Encode an integer."""
+    if _fast_int:
+        if value < 0:
+            length = (~value).bit_length() // 8 + 1
+        else:
+            length = value.bit_length() // 8 + 1
+        return value.to_bytes(length, 'big', signed=True)
+    # Encode the bytes of the value, or of ~value for negative values, and
+    # keep the top bit clear so that it can hold the sign.
+    negative = value < 0
+    if negative:
+        value = ~value
+    values = []
+    while value > 0x7f:
+        values.append(value & 0xff)
+        value >>= 8
+    values.append(value)
+    if negative:
+        values = [0xff - byte for byte in values]
+    values.reverse()
+    return bytes(values)
+
+
+def _decode_integer(bytes_data):
+    """Decode an integer value."""
+    if len(bytes_data) == 0:
+        raise Error('ASN1 syntax error')
+    # check if the integer is normalized
+    if len(bytes_data) > 1 and \
+            (bytes_data[0] == 0xff and bytes_data[1] & 0x80 or
+             bytes_data[0] == 0x00 and not (bytes_data[1] & 0x80)):
+        raise Error('ASN1 syntax error')
+    if _fast_int:
+        return int.from_bytes(bytes_data, 'big', signed=True)
+    values = [int(b) for b in bytes_data]
+    negative = values[0] & 0x80
+    if negative:
+        # make positive by taking two's complement
+        for i in range(len(values)):
+            values[i] = 0xff - values[i]
+        for i in range(len(values) - 1, -1, -1):
+            values[i] += 1
+            if values[i] <= 0xff:
+                break
+            assert i > 0
+            values[i] = 0x00
+    value = 0
+    for val in values:
+        value = (value << 8) | val
+    if negative:
+        value = -value
+    try:
+        value = int(value)
+    except OverflowError:
+        pass
+    return value
+
+
+def _encode_octet_string(value):
+    """Encode an octetstring."""
+    # Use the primitive encoding
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    assert isinstance(value, (bytes, bytearray, memoryview))
+    return value
+
+
+def _decode_octet_string(bytes_data):
+    """Decode an octet string."""
+    return bytes_data
+
+
+def _encode_null(value):
+    """Encode a Null value."""
+    return b''
+
+
+def _decode_null(bytes_data):
+    """Decode a Null value."""
+    if len(bytes_data) != 0:
+        raise Error('ASN1 syntax error')
+    return None
+
+
+_re_oid = re.compile(r'^[0-9]+(\.[0-9]+)+$')
+
+
+def _encode_object_identifier(oid):
+    """Encode an object identifier."""
+    if not _re_oid.match(oid):
+        raise Error('Illegal object identifier')
+    cmps = [int(cmp) for cmp in oid.split('.')]
+    if cmps[0] > 39 or cmps[1] > 39:
+        raise Error('Illegal object identifier')
+    cmps[1] += 40 * cmps[0]
+    result = bytearray()
+    for i in range(1, len(cmps)):
+        cmp = cmps[i]
+        if cmp < 0x80:
+            result.append(cmp)
+            continue
+        values = bytearray()
+        values.append(cmp & 0x7f)
+        cmp >>= 7
+        while cmp:
+            values.append(0x80 | (cmp & 0x7f))
+            cmp >>= 7
+        values.reverse()
+        result += values
+    return bytes(result)
+
+
+def _decode_object_identifier(bytes_data):
+    """Decode an object identifier."""
+    result = []
+    value = 0
+    for byte in bytes_data:
+        if value == 0 and byte == 0x80:
+            raise Error('ASN1 syntax error')
+        value = (value << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            result.append(value)
+            value = 0
+    if len(result) == 0 or result[0] > 1599:
+        raise Error('ASN1 syntax error')
+    first = result[0]
+    result[0] = '%d.%d' % (first // 40, first % 40)
+    for i in range(1, len(result)):
+        result[i] = str(result[i])
+    return '.'.join(result)
+
+
+def _encode_bit_string(value):
+    """Encode a bit string. The value is either bytes, or a (bytes,
+    unused bits) tuple."""
+    if isinstance(value, tuple):
+        value, unused = value
+    else:
+        unused = 0
+    if not 0 <= unused <= 7 or unused and not value:
+        raise Error('Illegal bit string')
+    return bytes((unused,)) + value
+
+
+def _decode_bit_string(bytes_data):
+    """Decode a bit string into a (bytes, unused bits) tuple."""
+    if len(bytes_data) == 0:
+        raise Error('ASN1 syntax error')
+    unused = bytes_data[0]
+    if unused > 7 or unused and len(bytes_data) == 1:
+        raise Error('ASN1 syntax error')
+    return (bytes_data[1:], unused)
+
+
+def _encode_utf8_string(value):
+    """Encode an UTF8String."""
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+
+def _decode_utf8_string(bytes_data):
+    """Decode an UTF8String."""
+    try:
+        return str(bytes_data, 'utf-8')
+    except UnicodeError:
+        raise Error('ASN1 syntax error')
+
+
+def _encode_ascii_string(value):
+    """Encode a PrintableString or IA5String."""
+    if isinstance(value, str):
+        try:
+            return value.encode('ascii')
+        except UnicodeError:
+            raise Error('Illegal character string')
+    return value
+
+
+def _decode_ascii_string(bytes_data):
+    """Decode a PrintableString or IA5String."""
+    for byte in bytes_data:
+        if byte > 0x7f:
+            raise Error('ASN1 syntax error')
+    return str(bytes_data, 'ascii')
+
+
+def _encode_time(value, fmt, century):
+    """Encode a datetime with the strftime-like format `fmt`."""
+    if isinstance(value, str):
+        return value.encode('ascii')
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return value
+    if value.tzinfo is not None:
+        value = value.astimezone(_datetime.timezone.utc)
+    year = value.year
+    if not century:
+        if not 1950 <= year < 2050:
+            raise Error('Year out of range for UTCTime')
+        year %= 100
+    result = fmt % (year, value.month, value.day, value.hour, value.minute,
+                    value.second)
+    if century and value.microsecond:
+        result += ('.%06d' % value.microsecond).rstrip('0')
+    return (result + 'Z').encode('ascii')
+
+
+def _decode_time(bytes_data, century):
+    """Decode an UTCTime (`century` false) or GeneralizedTime value into
+    a datetime, or into a str if the datetime module is not available."""
+    text = _decode_ascii_string(bytes_data)
+    if _datetime is None:
+        return text
+    try:
+        if century:
+            year = int(text[:4])
+            pos = 4
+        else:
+            year = int(text[:2])
+            year += 1900 if year >= 50 else 2000
+            pos = 2
+        fields = [year]
+        # month, day, hour, [minute, [second]]
+        while len(fields) < 6 and pos + 2 <= len(text) and \
+                text[pos].isdigit():
+            fields.append(int(text[pos:pos+2]))
+            pos += 2
+        if len(fields) < (4 if century else 5):
+            raise ValueError
+        while len(fields) < 6:
+            fields.append(0)
+        micro = 0
+        if century and pos < len(text) and text[pos] in '.,':
+            end = pos + 1
+            while end < len(text) and text[end].isdigit():
+                end += 1
+            fraction = text[pos+1:end]
+            if not fraction:
+                raise ValueError
+            micro = int((fraction + '000000')[:6])
+            pos = end
+        zone = text[pos:]
+        if zone == 'Z':
+            tzinfo = _datetime.timezone.utc
+        elif len(zone) == 5 and zone[0] in '+-':
+            offset = _datetime.timedelta(hours=int(zone[1:3]),
+                                         minutes=int(zone[3:5]))
+            if zone[0] == '-':
+                offset = -offset
+            tzinfo = _datetime.timezone(offset)
+        elif not zone and century:
+            tzinfo = None
+        else:
+            raise ValueError
+        fields.append(micro)
+        return _datetime.datetime(*fields, tzinfo=tzinfo)
+    except ValueError:
+        raise Error('ASN1 syntax error')
+
+
+def _encode_utc_time(value):
+    """Encode an UTCTime."""
+    return _encode_time(value, '%02d%02d%02d%02d%02d%02d', False)
+
+
+def _decode_utc_time(bytes_data):
+    """Decode an UTCTime."""
+    return _decode_time(bytes_data, False)
+
+
+def _encode_generalized_time(value):
+    """Encode a GeneralizedTime."""
+    return _encode_time(value, '%04d%02d%02d%02d%02d%02d', True)
+
+
+def _decode_generalized_time(bytes_data):
+    """Decode a GeneralizedTime."""
+    return _decode_time(bytes_data, True)
+
+
+def _encode_real(value):
+    """Encode a real, using the DER base 2 form."""
+    value = float(value)
+    if value == 0:
+        if math.copysign(1.0, value) < 0:
+            return b'\x43'
+        return b''
+    if value != value:
+        return b'\x42'
+    if value in (_inf, -_inf):
+        return value > 0 and b'\x40' or b'\x41'
+    mantissa, exponent = math.frexp(abs(value))
+    mantissa = int(math.ldexp(mantissa, 53))
+    exponent -= 53
+    while not mantissa & 1:
+        mantissa >>= 1
+        exponent += 1
+    head = 0x80
+    if value < 0:
+        head |= 0x40
+    exponent = _encode_integer(exponent)
+    if len(exponent) <= 3:
+        head = bytes((head | (len(exponent) - 1),))
+    else:
+        head = bytes((head | 0x03, len(exponent)))
+    values = bytearray()
+    while mantissa:
+        values.append(mantissa & 0xff)
+        mantissa >>= 8
+    values.reverse()
+    return head + exponent + values
+
+
+def _decode_real(bytes_data):
+    """Decode a real."""
+    if len(bytes_data) == 0:
+        return 0.0
+    head = bytes_data[0]
+    if head & 0x80:
+        base = head & 0x30
+        if base == 0x30:
+            raise Error('ASN1 syntax error')
+        pos = 1
+        count = (head & 0x03) + 1
+        if count == 4:
+            if len(bytes_data) < 2:
+                raise Error('ASN1 syntax error')
+            count = bytes_data[1]
+            pos = 2
+        if count == 0 or pos + count > len(bytes_data):
+            raise Error('ASN1 syntax error')
+        exponent = _decode_integer(bytes_data[pos:pos+count])
+        if _fast_int:
+            mantissa = int.from_bytes(bytes_data[pos+count:], 'big')
+        else:
+            mantissa = 0
+            for byte in bytes_data[pos+count:]:
+                mantissa = (mantissa << 8) | byte
+        # base 2, 8 or 16, and the scaling factor F
+        exponent *= (1, 3, 4)[base >> 4]
+        exponent += (head >> 2) & 0x03
+        try:
+            value = math.ldexp(float(mantissa), exponent)
+        except OverflowError:
+            raise Error('Real out of range')
+        if head & 0x40:
+            value = -value
+        return value
+    elif head & 0x40:
+        if len(bytes_data) != 1 or head > 0x43:
+            raise Error('ASN1 syntax error')
+        return (_inf, -_inf, _inf - _inf, -0.0)[head & 0x03]
+    if head not in (0x01, 0x02, 0x03):
+        raise Error('ASN1 syntax error')
+    text = _decode_ascii_string(bytes_data[1:]).replace(',', '.')
+    try:
+        return float(text)
+    except ValueError:
+        raise Error('ASN1 syntax error')
+
+
+class OIDCache(object):
+    """A bounded cache of object identifier encodings, in both directions.
+
+    Entries are evicted in least recently used order (on MicroPython ports
+    whose dicts do not keep insertion order, the evicted entry is
+    arbitrary). A cache with a maximum size of 0 is disabled.
+    """
+
+    def __init__(self, maxsize=256):
+        """Constructor."""
+        self.m_maxsize = maxsize
+        self.m_encoded = {}
+        self.m_decoded = {}
+        self.m_hits = 0
+        self.m_misses = 0
+
+    def encode(self, oid):
+        """Return the encoding of `oid`."""
+        if not self.m_maxsize:
+            return _encode_object_identifier(oid)
+        cache = self.m_encoded
+        try:
+            value = cache.pop(oid)
+        except KeyError:
+            self.m_misses += 1
+            value = _encode_object_identifier(oid)
+        else:
+            self.m_hits += 1
+        self._store(cache, oid, value)
+        return value
+
+    def decode(self, bytes_data):
+        """Return the object identifier encoded as `bytes_data`."""
+        if not self.m_maxsize:
+            return _decode_object_identifier(bytes_data)
+        key = bytes(bytes_data)
+        cache = self.m_decoded
+        try:
+            value = cache.pop(key)
+        except KeyError:
+            self.m_misses += 1
+            value = _decode_object_identifier(key)
+        else:
+            self.m_hits += 1
+        self._store(cache, key, value)
+        return value
+
+    def preload(self, oids):
+        """Add the object identifiers `oids` to the cache."""
+        if not self.m_maxsize:
+            return
+        for oid in oids:
+            value = _encode_object_identifier(oid)
+            self._store(self.m_encoded, oid, value)
+            self._store(self.m_decoded, value, oid)
+
+    def resize(self, maxsize):
+        """Change the maximum size of the cache. A size of 0 disables
+        the cache and frees all entries."""
+        self.m_maxsize = maxsize
+        for cache in (self.m_encoded, self.m_decoded):
+            if not maxsize:
+                cache.clear()
+            while len(cache) > maxsize:
+                self._evict(cache)
+
+    def clear(self):
+        """Remove all entries and reset the counters."""
+        self.m_encoded.clear()
+        self.m_decoded.clear()
+        self.m_hits = 0
+        self.m_misses = 0
+
+    def info(self):
+        """Return a (hits, misses, size, maxsize) tuple. The size counts
+        the entries of both directions, each of which holds up to maxsize
+        entries."""
+        return (self.m_hits, self.m_misses,
+                len(self.m_encoded) + len(self.m_decoded), self.m_maxsize)
+
+    def _store(self, cache, key, value):
+        """Store a value as the most recently used entry."""
+        cache[key] = value
+        # Other threads may add entries at the same time.
+        while len(cache) > self.m_maxsize:
+            self._evict(cache)
+
+    def _evict(self, cache):
+        """Remove the least recently used entry."""
+        try:
+            del cache[next(iter(cache))]
+        except (KeyError, RuntimeError, StopIteration):
+            # modified by another thread
+            pass
+
+
+_well_known_oids = (
+    '1.2.840.113549.1.1.1',     # rsaEncryption
+    '1.2.840.113549.1.1.5',     # sha1WithRSAEncryption
+    '1.2.840.113549.1.1.11',    # sha256WithRSAEncryption
+    '1.2.840.113549.1.1.12',    # sha384WithRSAEncryption
+    '1.2.840.113549.1.1.13',    # sha512WithRSAEncryption
+    '1.2.840.113549.1.9.1',     # emailAddress
+    '1.2.840.10045.2.1',        # ecPublicKey
+    '1.2.840.10045.3.1.7',      # prime256v1
+    '1.2.840.10045.4.3.2',      # ecdsa-with-SHA256
+    '1.2.840.10045.4.3.3',      # ecdsa-with-SHA384
+    '1.3.132.0.34',             # secp384r1
+    '1.3.101.112',              # Ed25519
+    '2.16.840.1.101.3.4.2.1',   # sha256
+    '2.5.4.3',                  # commonName
+    '2.5.4.5',                  # serialNumber
+    '2.5.4.6',                  # countryName
+    '2.5.4.7',                  # localityName
+    '2.5.4.8',                  # stateOrProvinceName
+    '2.5.4.10',                 # organizationName
+    '2.5.4.11',                 # organizationalUnitName
+    '2.5.29.14',                # subjectKeyIdentifier
+    '2.5.29.15',                # keyUsage
+    '2.5.29.17',                # subjectAltName
+    '2.5.29.19',                # basicConstraints
+    '2.5.29.20',                # cRLNumber
+    '2.5.29.21',                # reasonCode
+    '2.5.29.31',                # cRLDistributionPoints
+    '2.5.29.32',                # certificatePolicies
+    '2.5.29.35',                # authorityKeyIdentifier
+    '2.5.29.37',                # extKeyUsage
+    '1.3.6.1.5.5.7.1.1',        # authorityInfoAccess
+    '1.3.6.1.5.5.7.3.1',        # serverAuth
+    '1.3.6.1.5.5.7.3.2',        # clientAuth
+    '1.3.6.1.2.1.1.1.0',        # sysDescr.0
+    '1.3.6.1.2.1.1.3.0',        # sysUpTime.0
+    '1.3.6.1.2.1.1.5.0',        # sysName.0
+    '1.3.6.1.6.3.1.1.4.1.0',    # snmpTrapOID.0
+)
+
+oid_cache = OIDCache()
+oid_cache.preload(_well_known_oids)
+
+
+def _encode_cached_object_identifier(oid):
+    """Encode an object identifier, using the cache."""
+    return oid_cache.encode(oid)
+
+
+def _decode_cached_object_identifier(bytes_data):
+    """Decode an object identifier, using the cache."""
+    return oid_cache.decode(bytes_data)
+
+
+_inf = float('inf')
+
+_encoders = {}
+_decoders = {}
+
+
+def register(nr, encode=None, decode=None, cls=ClassUniversal):
+    """Register the codec for primitive values with number `nr` in class
+    `cls`.
+
+    `encode` is called with a Python value and must return the encoded
+    contents octets; `decode` is called with the contents octets and must
+    return the Python value. Passing None for either removes it, values are
+    then written and read as raw bytes.
+    """
+    key = (cls, nr)
+    for table, func in ((_encoders, encode), (_decoders, decode)):
+        if func is None:
+            table.pop(key, None)
+        else:
+            table[key] = func
+
+
+def lookup(nr, cls=ClassUniversal):
+    """Return the (encode, decode) functions registered for primitive values
+    with number `nr` in class `cls`. Missing functions are None."""
+    key = (cls, nr)
+    return (_encoders.get(key), _decoders.get(key))
+
+
+register(Boolean, _encode_boolean, _decode_boolean)
+register(Integer, _encode_integer, _decode_integer)
+register(BitString, _encode_bit_string, _decode_bit_string)
+register(OctetString, _encode_octet_string, _decode_octet_string)
+register(Null, _encode_null, _decode_null)
+register(ObjectIdentifier, _encode_cached_object_identifier,
+         _decode_cached_object_identifier)
+register(Real, _encode_real, _decode_real)
+register(Enumerated, _encode_integer, _decode_integer)
+register(UTF8String, _encode_utf8_string, _decode_utf8_string)
+register(PrintableString, _encode_ascii_string, _decode_ascii_string)
+register(IA5String, _encode_ascii_string, _decode_ascii_string)
+register(UTCTime, _encode_utc_time, _decode_utc_time)
+register(GeneralizedTime, _encode_generalized_time, _decode_generalized_time)
+
+
+_string_types = (BitString, OctetString, UTF8String, PrintableString,
+                 IA5String, UTCTime, GeneralizedTime)
+
+
+# The tags of the identifier octets that are a complete short form tag.
+_short_tags = tuple([(byte & 0x1f, byte & 0x20, byte & 0xc0)
+                     if byte & 0x1f != 0x1f else None
+                     for byte in range(256)])
+
+
+def _end_of_contents(data, index, end, max_depth=_inf):
+    """Return the offset of the end-of-contents octets of the indefinite
+    length value whose contents start at `index` in `data`, which must not
+    extend beyond `end`. Only the headers of the contents are read. Nested
+    indefinite length values deeper than `max_depth` are an error."""
+    depth = 0
+    while True:
+        if index + 2 > end:
+            raise _PrematureEnd(index + 2 - end)
+        byte = data[index]
+        if byte == 0 and data[index+1] == 0:
+            if depth == 0:
+                return index
+            depth -= 1
+            index += 2
+            continue
+        index += 1
+        if byte & 0x1f == 0x1f:
+            while index < end and data[index] & 0x80:
+                index += 1
+            index += 1
+        if index >= end:
+            raise _PrematureEnd()
+        length = data[index]
+        index += 1
+        if length == 0x80:
+            if not byte & TypeConstructed:
+                raise Error('ASN1 syntax error')
+            depth += 1
+            if depth > max_depth:
+                raise Error('Nesting depth exceeds limit.')
+            continue
+        if length & 0x80:
+            count = length & 0x7f
+            if count == 0x7f:
+                raise Error('ASN1 syntax error')
+            if index + count > end:
+                raise _PrematureEnd(index + count - end)
+            length = 0
+            for i in range(index, index + count):
+                length = (length << 8) | data[i]
+            index += count
+        index += length
+        if index > end:
+            raise _PrematureEnd(index - end)
+
+
+def _long_length(length):
+    """Return the long form length octets for `length`."""
+    values = bytearray()
+    while length:
+        values.append(length & 0xff)
+        length >>= 8
+    # really for correctness as this should not happen anytime soon
+    assert len(values) < 127
+    values.append(0x80 | len(values))
+    values.reverse()
+    return values
+
+
+def _patch_length(buf, start):
+    """Fill in the length of the constructed value in `buf` whose contents
+    start at `start` and run to the end of `buf`. A single length octet must
+    have been reserved before `start`; the contents are only moved if the
+    length does not fit in it."""
+    length = len(buf) - start
+    if length < 128:
+        buf[start-1] = length
+    else:
+        buf[start-1:start] = _long_length(length)
+
+
+def _check_raw(data):
+    """Check that `data` consists of complete TLV records."""
+    index = 0
+    end = len(data)
+    while index < end:
+        index = _tlv_end_at(data, index, end)
+
+
 class Encoder(object):
     """A ASN.1 encoder. Uses DER encoding."""
 
     def __init__(self):
         """Constructor."""
+        self.m_buffer = None
         self.m_stack = None
 
     def start(self):
         """Start encoding."""
-        self.m_stack = [[]]
+        self.m_buffer = bytearray()
+        self.m_stack = []
 
     def enter(self, nr, cls=None):
         """Start a constructed data value."""
@@ -48,18 +762,17 @@ class Encoder(object):
         if cls is None:
             cls = ClassUniversal
         self._emit_tag(nr, TypeConstructed, cls)
-        self.m_stack.append([])
+        # Reserve one length octet, patched up by leave().
+        self.m_buffer.append(0)
+        self.m_stack.append(len(self.m_buffer))
 
     def leave(self):
         """Finish a constructed data value."""
         if self.m_stack is None:
             raise Error('Encoder not initialized. Call start() first.')
-        if len(self.m_stack) == 1:
+        if not self.m_stack:
             raise Error('Tag stack is empty.')
-        value = b''.join(self.m_stack[-1])
-        del self.m_stack[-1]
-        self._emit_length(len(value))
-        self._emit(value)
+        _patch_length(self.m_buffer, self.m_stack.pop())
 
     def write(self, value, nr=None, typ=None, cls=None):
         """Write a primitive data value."""
@@ -68,27 +781,49 @@ class Encoder(object):
         if nr is None:
             if isinstance(value, int):
                 nr = Integer
-            elif isinstance(value, str):
+            elif isinstance(value, (str, bytes, bytearray, memoryview)):
                 nr = OctetString
+            elif isinstance(value, float):
+                nr = Real
             elif value is None:
                 nr = Null
         if typ is None:
             typ = TypePrimitive
         if cls is None:
             cls = ClassUniversal
-        value = self._encode_value(nr, value)
+        value = self._encode_value(nr, typ, cls, value)
         self._emit_tag(nr, typ, cls)
         self._emit_length(len(value))
         self._emit(value)
 
+    def write_raw(self, data, validate=False):
+        """Write complete, already encoded TLV records, such as returned by
+        Decoder.read_raw(), without decoding them.
+
+        The records are `data`, a bytes-like object holding one or more
+        records back to back, or a list of such objects. They are copied
+        into the output once, and count towards the length of the enclosing
+        constructed values like any other value. If `validate` is true, the
+        tags and lengths of the top-level records are checked to fill the
+        data exactly.
+        """
+        if self.m_stack is None:
+            raise Error('Encoder not initialized. Call start() first.')
+        if isinstance(data, (list, tuple)):
+            for item in data:
+                self.write_raw(item, validate)
+            return
+        if validate:
+            _check_raw(data)
+        self._emit(data)
+
     def output(self):
         """Return the encoded output."""
         if self.m_stack is None:
             raise Error('Encoder not initialized. Call start() first.')
-        if len(self.m_stack) != 1:
+        if self.m_stack:
             raise Error('Stack is not empty.')
-        output = b''.join(self.m_stack[0])
-        return output
+        return bytes(self.m_buffer)
 
     def _emit_tag(self, nr, typ, cls):
         """Emit a tag."""
@@ -100,20 +835,19 @@ class Encoder(object):
     def _emit_tag_short(self, nr, typ, cls):
         """Emit a short (< 31 bytes) tag."""
         assert nr < 31
-        self._emit(bytes([nr | typ | cls]))
+        self.m_buffer.append(nr | typ | cls)
 
     def _emit_tag_long(self, nr, typ, cls):
         """Emit a long (>= 31 bytes) tag."""
-        head = bytes([typ | cls | 0x1f])
-        self._emit(head)
-        values = [nr & 0x7f]
+        values = bytearray()
+        values.append(nr & 0x7f)
         nr >>= 7
         while nr:
             values.append((nr & 0x7f) | 0x80)
             nr >>= 7
+        values.append(typ | cls | 0x1f)
         values.reverse()
-        for val in values:
-            self._emit(bytes([val]))
+        self.m_buffer += values
 
     def _emit_length(self, length):
         """Emit length octects."""
@@ -125,127 +859,362 @@ class Encoder(object):
     def _emit_length_short(self, length):
         """Emit the short length form (< 128 octets)."""
         assert length < 128
-        self._emit(bytes([length]))
+        self.m_buffer.append(length)
 
     def _emit_length_long(self, length):
         """Emit the long length form (>= 128 octets)."""
-        values = []
-        while length:
-            values.append(length & 0xff)
-            length >>= 8
-        values.reverse()
-        # really for correctness as this should not happen anytime soon
-        assert len(values) < 127
-        head = bytes([0x80 | len(values)])
-        self._emit(head)
-        for val in values:
-            self._emit(bytes([val]))
+        self.m_buffer += _long_length(length)
 
     def _emit(self, s):
         """Emit raw bytes."""
-        assert isinstance(s, bytes)
-        self.m_stack[-1].append(s)
+        self.m_buffer += s
 
-    def _encode_value(self, nr, value):
+    def _encode_value(self, nr, typ, cls, value):
         """Encode a value."""
-        if nr in (Integer, Enumerated):
-            value = self._encode_integer(value)
-        elif nr == OctetString:
-            value = self._encode_octet_string(value)
-        elif nr == Boolean:
-            value = self._encode_boolean(value)
-        elif nr == Null:
-            value = self._encode_null()
-        elif nr == ObjectIdentifier:
-            value = self._encode_object_identifier(value)
+        if typ == TypePrimitive:
+            encode = _encoders.get((cls, nr))
+            if encode is not None:
+                value = encode(value)
+            elif not isinstance(value, (bytes, bytearray, memoryview)):
+                # Values without a codec are raw contents, as the decoder
+                # returns them.
+                raise Error('No encoder for tag %s of class %#02x; pass the '
+                            'contents as bytes.' % (nr, cls))
         return value
 
-    def _encode_boolean(self, value):
-        """Encode a boolean."""
-        return value and b'\xff' or b'\x00'
 
-    def _encode_integer(self, value):
-        """Encode an integer."""
-        if value < 0:
-            value = -value
-            negative = True
-            limit = 0x80
+class Template(object):
+    """An encoding with named slots for values that are only known later.
+
+    A template is recorded once with the same enter(), leave() and write()
+    calls as an Encoder, and with slot() calls for the variable values.
+    Constructed values without slots are encoded completely while they are
+    recorded. fill() then only encodes the slot values, copies the constant
+    parts and fixes up the lengths of the constructed values that contain
+    slots.
+    """
+
+    def __init__(self):
+        """Constructor."""
+        self.m_encoder = Encoder()
+        self.m_encoder.start()
+        self.m_ops = []
+        self.m_stack = []
+
+    def enter(self, nr, cls=None):
+        """Start a constructed data value."""
+        self.m_stack.append(len(self.m_encoder.m_buffer))
+        self.m_encoder.enter(nr, cls)
+
+    def leave(self):
+        """Finish a constructed data value."""
+        if not self.m_stack:
+            raise Error('Tag stack is empty.')
+        if self.m_stack.pop() is None:
+            self._flush()
+            self.m_ops.append(('leave', None))
         else:
-            negative = False
-            limit = 0x7f
-        values = []
-        while value > limit:
-            values.append(value & 0xff)
-            value >>= 8
-        values.append(value & 0xff)
-        if negative:
-            # create two's complement
-            for i in range(len(values)):
-                values[i] = 0xff - values[i]
-            for i in range(len(values)):
-                values[i] += 1
-                if values[i] <= 0xff:
-                    break
-                assert i != len(values) - 1
-                values[i] = 0x00
-        values.reverse()
-        return bytes(values)
-
-    def _encode_octet_string(self, value):
-        """Encode an octetstring."""
-        # Use the primitive encoding
-        assert isinstance(value, str) or isinstance(value, bytes)
-        if isinstance(value, str):
-            return value.encode('utf-8')
+            self.m_encoder.leave()
+
+    def write(self, value, nr=None, typ=None, cls=None):
+        """Write a constant primitive data value."""
+        self.m_encoder.write(value, nr, typ, cls)
+
+    def write_raw(self, data, validate=False):
+        """Write constant, already encoded TLV records."""
+        self.m_encoder.write_raw(data, validate)
+
+    def slot(self, name, nr=None, typ=None, cls=None):
+        """Add a slot for a value named `name`. The value is written by
+        fill(), with the same type arguments as write()."""
+        buf = self.m_encoder.m_buffer
+        offset = 0
+        # Split the headers of all enclosing values that are still
+        # encoded as a whole out of the constant data.
+        for i in range(len(self.m_stack)):
+            start = self.m_stack[i]
+            if start is None:
+                continue
+            end = self.m_encoder.m_stack.pop(0) - 1
+            self._constant(buf[offset:start])
+            self.m_ops.append(('enter', bytes(buf[start:end])))
+            self.m_stack[i] = None
+            offset = end + 1
+        del buf[:offset]
+        self._flush()
+        self.m_ops.append(('slot', (name, nr, typ, cls)))
+
+    def fill(self, values):
+        """Return the encoding with the slots filled in from the dictionary
+        `values`."""
+        if self.m_stack:
+            raise Error('Stack is not empty.')
+        self._flush()
+        enc = Encoder()
+        enc.start()
+        buf = enc.m_buffer
+        stack = enc.m_stack
+        for op, arg in self.m_ops:
+            if op == 'constant':
+                buf += arg
+            elif op == 'slot':
+                enc.write(values[arg[0]], arg[1], arg[2], arg[3])
+            elif op == 'enter':
+                buf += arg
+                buf.append(0)
+                stack.append(len(buf))
+            else:
+                _patch_length(buf, stack.pop())
+        return bytes(buf)
+
+    def _flush(self):
+        """Move the constant data recorded so far to the operations."""
+        self._constant(self.m_encoder.m_buffer)
+        del self.m_encoder.m_buffer[:]
+
+    def _constant(self, data):
+        """Add constant data to the operations."""
+        if not data:
+            return
+        if self.m_ops and self.m_ops[-1][0] == 'constant':
+            self.m_ops[-1] = ('constant', self.m_ops[-1][1] + bytes(data))
         else:
-            return value
+            self.m_ops.append(('constant', bytes(data)))
 
-    def _encode_null(self):
-        """Encode a Null value."""
-        return b''
 
-    _re_oid = re.compile(r'^[0-9]+(\.[0-9]+)+$')
-
-    def _encode_object_identifier(self, oid):
-        """Encode an object identifier."""
-        if not self._re_oid.match(oid):
-            raise Error('Illegal object identifier')
-        cmps = list(map(int, oid.split('.')))
-        if cmps[0] > 39 or cmps[1] > 39:
-            raise Error('Illegal object identifier')
-        cmps = [40 * cmps[0] + cmps[1]] + cmps[2:]
-        cmps.reverse()
-        result = []
-        for cmp in cmps:
-            result.append(cmp & 0x7f)
-            while cmp > 0x7f:
-                cmp >>= 7
-                result.append(0x80 | (cmp & 0x7f))
-        result.reverse()
-        return bytes(result)
+class StreamEncoder(Encoder):
+    """An ASN.1 encoder that writes its output to a sink.
+
+    The output is written to `sink`, which can be any object with a
+    write() method, whenever more than `bufsize` bytes are buffered. Only
+    the buffer and the stack of open constructed values are kept in memory.
+
+    By default constructed values are written with the BER indefinite
+    length form. For DER output, pass the content lengths of all
+    constructed values, in the order in which they are entered, as
+    `lengths`. These lengths can be computed by a first pass with `sink`
+    set to None, which only counts the output, see lengths().
+    """
+
+    def __init__(self, sink, lengths=None, bufsize=16384):
+        """Constructor."""
+        Encoder.__init__(self)
+        self.m_sink = sink
+        self.m_lengths = lengths
+        self.m_bufsize = bufsize
+        self.m_count = None
+        self.m_written = None
+
+    def start(self):
+        """Start encoding."""
+        Encoder.start(self)
+        if self.m_sink is None:
+            self.m_lengths = []
+        self.m_count = 0
+        self.m_written = 0
+
+    def enter(self, nr, cls=None):
+        """Start a constructed data value."""
+        if self.m_stack is None:
+            raise Error('Encoder not initialized. Call start() first.')
+        if cls is None:
+            cls = ClassUniversal
+        self._emit_tag(nr, TypeConstructed, cls)
+        if self.m_sink is None:
+            length = len(self.m_lengths)
+            self.m_lengths.append(None)
+        elif self.m_lengths is None:
+            length = None
+            self.m_buffer.append(0x80)
+        else:
+            if self.m_count >= len(self.m_lengths):
+                raise Error('No length declared for constructed value.')
+            length = self.m_lengths[self.m_count]
+            self.m_count += 1
+            self._emit_length(length)
+        self.m_stack.append((self.m_written + len(self.m_buffer), length))
+
+    def leave(self):
+        """Finish a constructed data value."""
+        if self.m_stack is None:
+            raise Error('Encoder not initialized. Call start() first.')
+        if not self.m_stack:
+            raise Error('Tag stack is empty.')
+        start, length = self.m_stack.pop()
+        size = self.m_written + len(self.m_buffer) - start
+        if self.m_sink is None:
+            # Count the length octets of the definite form.
+            self.m_lengths[length] = size
+            self._emit_length(size)
+        elif length is None:
+            self.m_buffer += b'\x00\x00'
+        elif size != length:
+            raise Error('Declared length %d but wrote %d bytes.'
+                        % (length, size))
+        if len(self.m_buffer) > self.m_bufsize:
+            self.flush()
+
+    def write(self, value, nr=None, typ=None, cls=None):
+        """Write a primitive data value."""
+        Encoder.write(self, value, nr, typ, cls)
+        if len(self.m_buffer) > self.m_bufsize:
+            self.flush()
+
+    def write_raw(self, data, validate=False):
+        """Write already encoded TLV records. Records larger than the buffer
+        are written to the sink directly."""
+        if self.m_stack is None:
+            raise Error('Encoder not initialized. Call start() first.')
+        if isinstance(data, (list, tuple)) or len(data) <= self.m_bufsize:
+            Encoder.write_raw(self, data, validate)
+            if len(self.m_buffer) > self.m_bufsize:
+                self.flush()
+            return
+        if validate:
+            _check_raw(data)
+        self.flush()
+        if self.m_sink is not None:
+            self.m_sink.write(data)
+        self.m_written += len(data)
+
+    def output(self):
+        """The output of a stream encoder is written to its sink."""
+        raise Error('Output is written to the sink.')
+
+    def flush(self):
+        """Write the buffered output to the sink."""
+        if self.m_buffer is None:
+            raise Error('Encoder not initialized. Call start() first.')
+        if self.m_sink is not None and self.m_buffer:
+            self.m_sink.write(bytes(self.m_buffer))
+        self.m_written += len(self.m_buffer)
+        del self.m_buffer[:]
+
+    def close(self):
+        """Finish encoding and write the remaining output to the sink."""
+        if self.m_stack is None:
+            raise Error('Encoder not initialized. Call start() first.')
+        if self.m_stack:
+            raise Error('Stack is not empty.')
+        self.flush()
+
+    def lengths(self):
+        """Return the content lengths of the constructed values, in the
+        order in which they were entered, and the total output size, as a
+        (lengths, size) tuple."""
+        if self.m_written is None:
+            raise Error('Encoder not initialized. Call start() first.')
+        return self.m_lengths, self.m_written + len(self.m_buffer)
 
 
 class Decoder(object):
-    """A ASN.1 decoder. Understands BER (and DER which is a subset)."""
+    """A ASN.1 decoder. Understands BER (and DER which is a subset).
 
-    def __init__(self):
+    Limits for untrusted input can be passed to the constructor. They are
+    checked before the data they apply to is copied or decoded, and an
+    Error is raised if one is exceeded:
+
+     * max_length: the largest length of a value, in bytes;
+     * max_depth: the deepest nesting of constructed values;
+     * max_elements: the number of TLV records per input;
+     * max_integer: the largest INTEGER or ENUMERATED value, and the
+       largest exponent and mantissa of a REAL, in bytes;
+     * max_arc: the largest object identifier arc, in bytes.
+    """
+
+    def __init__(self, max_length=None, max_depth=None, max_elements=None,
+                 max_integer=None, max_arc=None):
         """Constructor."""
+        self.m_input = None
         self.m_stack = None
         self.m_tag = None
+        self.m_offset = None
+        self.m_view = False
+        self.m_map = None
+        self.m_file = None
+        self.m_max_length = _inf if max_length is None else max_length
+        self.m_max_depth = _inf if max_depth is None else max_depth
+        self.m_max_elements = _inf if max_elements is None else max_elements
+        self.m_max_integer = max_integer
+        self.m_max_arc = max_arc
+        self.m_check = max_integer is not None or max_arc is not None
+        self.m_elements = None
+
+    def start(self, data, view=False):
+        """Start processing `data`.
+
+        The decoder keeps a stack of (index, end) windows into `data`, so
+        entering a constructed value never copies it. If `view` is true,
+        the input is wrapped in a memoryview and raw values (octet strings,
+        unknown types) are returned as views into it instead of as copies.
+        """
+        if view:
+            data = memoryview(data)
+        self.m_input = data
+        self.m_view = bool(view)
+        self.m_stack = [[0, len(data)]]
+        self.m_tag = None
+        self.m_elements = self.m_max_elements
+
+    def open(self, source):
+        """Start processing the file with path `source`, or the mmap object
+        `source`.
+
+        A file is mapped into memory read-only. The decoder works as if it
+        was started with `view` set, so only the pages of the file that are
+        actually visited are read, and raw values are views into the
+        mapping. Call close() to unmap a file that was opened by path.
+        """
+        if _mmap is None:
+            raise Error('Memory mapped files are not supported.')
+        self.close()
+        if isinstance(source, str):
+            fobj = open(source, 'rb')
+            try:
+                if fobj.seek(0, 2) == 0:
+                    # Empty files cannot be mapped.
+                    data = b''
+                else:
+                    data = _mmap.mmap(fobj.fileno(), 0,
+                                      access=_mmap.ACCESS_READ)
+                    self.m_map = data
+            except Exception:
+                fobj.close()
+                raise
+            self.m_file = fobj
+        else:
+            data = source
+        self.start(data, view=True)
 
-    def start(self, data):
-        """Start processing `data`."""
-        self.m_stack = [[0, data]]
+    def close(self):
+        """Stop processing the input, and unmap the file that was opened by
+        open(). All views into the file must have been released."""
+        if self.m_view:
+            # Only release the view that start() created.
+            self.m_input.release()
+            self.m_view = False
+        self.m_input = None
+        self.m_stack = None
         self.m_tag = None
+        if self.m_map is not None:
+            try:
+                self.m_map.close()
+            except BufferError:
+                raise Error('Views into the file are still in use.')
+            self.m_map = None
+        if self.m_file is not None:
+            self.m_file.close()
+            self.m_file = None
 
     def peek(self):
         """Return the value of the next tag without moving to the next
         TLV record."""
         if self.m_stack is None:
             raise Error('No input selected. Call start() first.')
-        if self._end_of_input():
-            return None
         if self.m_tag is None:
+            if self._end_of_input():
+                return None
+            self.m_offset = self.m_stack[-1][0]
             self.m_tag = self._read_tag()
         return self.m_tag
 
@@ -253,30 +1222,294 @@ class Decoder(object):
         """Read a simple value and move to the next TLV record."""
         if self.m_stack is None:
             raise Error('No input selected. Call start() first.')
-        if self._end_of_input():
-            return None
         tag = self.peek()
+        if tag is None:
+            return None
         length = self._read_length()
-        value = self._read_value(tag[0], length)
+        if length is None:
+            length = self._indefinite_length(tag)
+            value = self._read_contents(tag, length)
+            self._skip_bytes(2)
+        else:
+            value = self._read_contents(tag, length)
         self.m_tag = None
         return (tag, value)
 
     def eof(self):
         """Return True if we are end of input."""
-        return self._end_of_input()
+        return self.m_tag is None and self._end_of_input()
 
     def enter(self):
         """Enter a constructed tag."""
         if self.m_stack is None:
             raise Error('No input selected. Call start() first.')
-        nr, typ, cls = self.peek()
-        if typ != TypeConstructed:
+        tag = self.peek()
+        if tag is None:
+            raise Error('Cannot enter at end of input.')
+        if tag[1] != TypeConstructed:
             raise Error('Cannot enter a non-constructed tag.')
+        if len(self.m_stack) > self.m_max_depth:
+            raise Error('Nesting depth exceeds limit.')
         length = self._read_length()
-        bytes_data = self._read_bytes(length)
-        self.m_stack.append([0, bytes_data])
+        index = self.m_stack[-1][0]
+        if length is None:
+            length = self._indefinite_length(self.m_tag)
+            self._skip_bytes(length + 2)
+        else:
+            self._skip_bytes(length)
+        self.m_stack.append([index, index + length])
         self.m_tag = None
 
+    def skip(self):
+        """Move to the next TLV record without decoding the current one.
+        Return the tag of the skipped record, or None at end of input."""
+        if self.m_stack is None:
+            raise Error('No input selected. Call start() first.')
+        tag = self.m_tag
+        if tag is None:
+            index, end = self.m_stack[-1]
+            if index == end:
+                return None
+            tag = self._read_tag()
+        else:
+            self.m_tag = None
+        length = self._read_length()
+        if length is None:
+            length = self._indefinite_length(tag) + 2
+        self._skip_bytes(length)
+        return tag
+
+    def read_raw(self):
+        """Return the complete encoding (header and value) of the current
+        TLV record, and move to the next one. The encoding is a view into
+        the input if the decoder was started with `view` set. Return None at
+        end of input."""
+        if self.m_stack is None:
+            raise Error('No input selected. Call start() first.')
+        if self.m_tag is None:
+            index, end = self.m_stack[-1]
+            if index == end:
+                return None
+            self.m_offset = index
+            tag = self._read_tag()
+        else:
+            tag = self.m_tag
+            self.m_tag = None
+        length = self._read_length()
+        if length is None:
+            length = self._indefinite_length(tag) + 2
+        index = self.m_stack[-1][0]
+        self._skip_bytes(length)
+        return self.m_input[self.m_offset:index+length]
+
+    def events(self):
+        """Generate all records from the current position to the end of the
+        current constructed value as (kind, tag, value, depth, offset)
+        tuples, like StreamDecoder does, without recursion.
+
+        The kind is EventStart or EventEnd for constructed values and
+        EventValue for the decoded primitive values. The depth is counted
+        from the current constructed value and the offset is the position of
+        the record in the input. The decoder moves past the records that are
+        generated; if the generator is closed early, it moves past the
+        top-level record that was being generated.
+        """
+        if self.m_stack is None:
+            raise Error('No input selected. Call start() first.')
+        frame = self.m_stack[-1]
+        if self.m_tag is not None:
+            frame[0] = self.m_offset
+            self.m_tag = None
+        data = self.m_input
+        tags = _short_tags
+        get_decoder = _decoders.get
+        decode_value = self._decode_value
+        check = self.m_check
+        max_length = self.m_max_length
+        max_depth = self._depth_limit()
+        limit = end0 = frame[1]
+        pos = frame[0]
+        # (limit, tag, offset, indefinite) of the open constructed values.
+        # Indefinite length values keep the limit of their parent and end
+        # at their end-of-contents octets.
+        stack = []
+        try:
+            while True:
+                while pos == limit and stack:
+                    limit, tag, offset, indefinite = stack.pop()
+                    if indefinite:
+                        raise _PrematureEnd(2)
+                    yield (EventEnd, tag, None, len(stack), offset)
+                if pos == limit:
+                    break
+                tag = tags[data[pos]]
+                if tag is not None and pos + 1 < limit and \
+                        not data[pos+1] & 0x80:
+                    # Fast path for the common short tag and short length.
+                    self.m_elements -= 1
+                    if self.m_elements < 0:
+                        raise Error('Number of elements exceeds limit.')
+                    length = data[pos+1]
+                    if length > max_length:
+                        raise Error('Length %d exceeds limit.' % length)
+                    offset = pos + 2
+                else:
+                    frame[0] = pos
+                    frame[1] = limit
+                    tag = self._read_tag()
+                    length = self._read_length()
+                    offset = frame[0]
+                if tag[1] == TypeConstructed:
+                    depth = len(stack)
+                    if depth >= max_depth:
+                        raise Error('Nesting depth exceeds limit.')
+                    if length is None:
+                        stack.append((limit, tag, pos, True))
+                    else:
+                        if offset + length > limit:
+                            raise _PrematureEnd(offset + length - limit)
+                        stack.append((limit, tag, pos, False))
+                        limit = offset + length
+                    yield (EventStart, tag, None, depth, pos)
+                    pos = offset
+                    continue
+                if not tag[0] and not tag[2]:
+                    # End-of-contents octets, which must be exactly 00 00.
+                    if length != 0 or offset != pos + 2 or not stack or \
+                            not stack[-1][3]:
+                        raise Error('ASN1 syntax error')
+                    limit, tag, offset, indefinite = stack.pop()
+                    pos += 2
+                    yield (EventEnd, tag, None, len(stack), offset)
+                    continue
+                if length is None:
+                    raise Error('ASN1 syntax error')
+                end = offset + length
+                if end > limit:
+                    raise _PrematureEnd(end - limit)
+                value = data[offset:end]
+                if check:
+                    value = decode_value(tag, value)
+                else:
+                    decode = get_decoder((tag[2], tag[0]))
+                    if decode is not None:
+                        value = decode(value)
+                offset = pos
+                pos = end
+                yield (EventValue, tag, value, len(stack), offset)
+            frame[0] = pos
+        except GeneratorExit:
+            frame[0] = pos
+            if stack:
+                # Closed early: skip the rest of the top-level record. If
+                # it is malformed, stay at its start, since generator
+                # finalization must not raise.
+                frame[0] = stack[0][2]
+                frame[1] = end0
+                try:
+                    self.skip()
+                except Error:
+                    frame[0] = stack[0][2]
+                    self.m_tag = None
+                self.m_elements += 1
+            raise
+        finally:
+            frame[1] = end0
+
+    def statistics(self, largest=10, stats=None):
+        """Scan all records from the current position to the end of the
+        current constructed value, reading only their headers, and return
+        aggregate statistics as a dictionary:
+
+         * 'records': the number of TLV records;
+         * 'tags': a dictionary mapping each tag to a [count, bytes] list,
+           where bytes is the total length of the contents;
+         * 'depths': a list with the number of records at each depth;
+         * 'largest': the (length, offset, tag) tuples of the `largest`
+           longest primitive records, longest first.
+
+        Values are never decoded or copied, so the memory used depends only
+        on the number of distinct tags. A dictionary returned by an earlier
+        call can be passed as `stats` to add to it. The decoder moves past
+        the records that are scanned.
+        """
+        if self.m_stack is None:
+            raise Error('No input selected. Call start() first.')
+        if stats is None:
+            stats = {'records': 0, 'tags': {}, 'depths': [], 'largest': []}
+        tags = stats['tags']
+        depths = stats['depths']
+        heap = list(stats['largest'])
+        heapq.heapify(heap)
+        count = stats['records']
+        frame = self.m_stack[-1]
+        if self.m_tag is not None:
+            frame[0] = self.m_offset
+            self.m_tag = None
+        max_depth = self._depth_limit()
+        limit = end0 = frame[1]
+        # (limit, tag, start, indefinite) of the open constructed values.
+        stack = []
+        try:
+            while True:
+                while frame[0] == limit and stack:
+                    if stack[-1][3]:
+                        raise _PrematureEnd(2)
+                    limit = stack.pop()[0]
+                    frame[1] = limit
+                if frame[0] == limit:
+                    break
+                offset = frame[0]
+                tag = self._read_tag()
+                length = self._read_length()
+                depth = len(stack)
+                if tag[1] == TypeConstructed:
+                    if depth >= max_depth:
+                        raise Error('Nesting depth exceeds limit.')
+                    stack.append((limit, tag, frame[0], length is None))
+                    if length is not None:
+                        limit = frame[0] + length
+                        if limit > frame[1]:
+                            raise _PrematureEnd(limit - frame[1])
+                        frame[1] = limit
+                elif not tag[0] and not tag[2]:
+                    # End-of-contents octets: add the length of the
+                    # indefinite length value they end. They must be
+                    # exactly 00 00.
+                    if length != 0 or frame[0] != offset + 2 or \
+                            not stack or not stack[-1][3]:
+                        raise Error('ASN1 syntax error')
+                    limit, tag, start, indefinite = stack.pop()
+                    frame[1] = limit
+                    tags[tag][1] += offset - start
+                    continue
+                else:
+                    if length is None:
+                        raise Error('ASN1 syntax error')
+                    self._skip_bytes(length)
+                    if len(heap) < largest:
+                        heapq.heappush(heap, (length, offset, tag))
+                    elif heap and length > heap[0][0]:
+                        heapq.heappop(heap)
+                        heapq.heappush(heap, (length, offset, tag))
+                count += 1
+                entry = tags.get(tag)
+                if entry is None:
+                    tags[tag] = [1, length or 0]
+                else:
+                    entry[0] += 1
+                    entry[1] += length or 0
+                if depth < len(depths):
+                    depths[depth] += 1
+                else:
+                    depths.append(1)
+        finally:
+            frame[1] = end0
+            stats['records'] = count
+            heap.sort(reverse=True)
+            stats['largest'] = heap
+        return stats
+
     def leave(self):
         """Leave the last entered constructed tag."""
         if self.m_stack is None:
@@ -286,16 +1519,76 @@ class Decoder(object):
         del self.m_stack[-1]
         self.m_tag = None
 
-    def _decode_boolean(self, bytes_data):
-        """Decode a boolean value."""
-        if len(bytes_data) != 1:
-            raise Error('ASN1 syntax error')
-        if bytes_data[0] == 0:
-            return False
-        return True
+    def select(self, path, raw=False):
+        """Return the record at `path`, starting from the current record,
+        without moving to the next TLV record.
+
+        The path is a Path, or a sequence that is converted into one. It is
+        followed by skipping over records using their lengths only, so
+        nothing but the target is decoded. The result is a (tag, value)
+        tuple like read() returns, or the complete encoding of the target
+        if `raw` is true. None is returned if there is no such record.
+        """
+        if self.m_stack is None:
+            raise Error('No input selected. Call start() first.')
+        if not isinstance(path, Path):
+            path = Path(path)
+        index, end = self.m_stack[-1]
+        if self.m_tag is not None:
+            index = self.m_offset
+        frame = [index, end]
+        self.m_stack.append(frame)
+        # The decoder does not move, so the headers that are read do not
+        # count towards max_elements after the call.
+        elements = self.m_elements
+        try:
+            return self._select(frame, path.m_steps, raw)
+        finally:
+            del self.m_stack[-1]
+            self.m_elements = elements
+
+    def _select(self, frame, steps, raw):
+        """Follow `steps` inside the window `frame`."""
+        last = len(steps) - 1
+        for i in range(len(steps)):
+            position, nr, typ, cls = steps[i]
+            count = 0
+            while True:
+                if frame[0] == frame[1]:
+                    return None
+                offset = frame[0]
+                tag = self._read_tag()
+                length = self._read_length()
+                index = frame[0]
+                trailer = 0
+                if length is None:
+                    length = self._indefinite_length(tag)
+                    trailer = 2
+                elif index + length > frame[1]:
+                    raise _PrematureEnd(index + length - frame[1])
+                if (position is None or position == count) and \
+                        (nr is None or nr == tag[0]) and \
+                        (typ is None or typ == tag[1]) and \
+                        (cls is None or cls == tag[2]):
+                    break
+                if position is not None and count >= position:
+                    return None
+                frame[0] = index + length + trailer
+                count += 1
+            if i == last:
+                break
+            if tag[1] != TypeConstructed:
+                return None
+            frame[1] = index + length
+        if raw:
+            return self.m_input[offset:index+length+trailer]
+        return (tag, self._read_contents(tag, length))
 
     def _read_tag(self):
         """Read a tag from the input."""
+        self.m_elements -= 1
+        if self.m_elements < 0:
+            raise Error('Number of elements exceeds limit.')
         byte = self._read_byte()
         cls = byte & 0xc0
         typ = byte & 0x20
@@ -310,12 +1603,15 @@ class Decoder(object):
         return (nr, typ, cls)
 
     def _read_length(self):
-        """Read a length from the input."""
+        """Read a length from the input. Return None for the indefinite
+        length form."""
         byte = self._read_byte()
         if byte & 0x80:
             count = byte & 0x7f
             if count == 0x7f:
                 raise Error('ASN1 syntax error')
+            if count == 0:
+                return None
             bytes_data = self._read_bytes(count)
             length = 0
             for byte in bytes_data:
@@ -326,105 +1622,1297 @@ class Decoder(object):
                 pass
         else:
             length = byte
+        if length > self.m_max_length:
+            raise Error('Length %d exceeds limit.' % length)
         return length
 
-    def _read_value(self, nr, length):
+    def _read_value(self, tag, length):
         """Read a value from the input."""
         bytes_data = self._read_bytes(length)
-        if nr == Boolean:
-            value = self._decode_boolean(bytes_data)
-        elif nr in (Integer, Enumerated):
-            value = self._decode_integer(bytes_data)
-        elif nr == OctetString:
-            value = self._decode_octet_string(bytes_data)
-        elif nr == Null:
-            value = self._decode_null(bytes_data)
+        return self._decode_value(tag, bytes_data)
+
+    def _read_contents(self, tag, length):
+        """Read the `length` bytes of contents of a value. Constructed
+        strings are reassembled from their segments and decoded like the
+        primitive string."""
+        if tag[1] == TypePrimitive or tag[2] != ClassUniversal or \
+                tag[0] not in _string_types:
+            return self._read_value(tag, length)
+        index = self.m_stack[-1][0]
+        self._skip_bytes(length)
+        self.m_stack.append([index, index + length])
+        parts = []
+        try:
+            self._read_segments(tag[0], parts)
+        finally:
+            del self.m_stack[-1]
+        if tag[0] == BitString:
+            # Each segment starts with its number of unused bits, which
+            # is zero for all but the last segment (X.690 8.6.4).
+            for i in range(len(parts)):
+                if not parts[i] or parts[i][0] != 0 and i < len(parts) - 1:
+                    raise Error('ASN1 syntax error')
+            unused = parts and parts[-1][:1] or b'\x00'
+            parts = [unused] + [part[1:] for part in parts]
+        return self._decode_value((tag[0], TypePrimitive, tag[2]),
+                                  b''.join(parts))
+
+    def _read_segments(self, nr, parts):
+        """Append the primitive segments of the constructed string of
+        type `nr` that is the current window to `parts`."""
+        while not self._end_of_input():
+            tag = self._read_tag()
+            if tag[0] != nr or tag[2] != ClassUniversal:
+                raise Error('ASN1 syntax error')
+            length = self._read_length()
+            if tag[1] == TypePrimitive:
+                if length is None:
+                    raise Error('ASN1 syntax error')
+                parts.append(self._read_bytes(length))
+                continue
+            if len(self.m_stack) > self.m_max_depth:
+                raise Error('Nesting depth exceeds limit.')
+            index = self.m_stack[-1][0]
+            if length is None:
+                length = self._indefinite_length(tag)
+                self._skip_bytes(length + 2)
+            else:
+                self._skip_bytes(length)
+            self.m_stack.append([index, index + length])
+            try:
+                self._read_segments(nr, parts)
+            finally:
+                del self.m_stack[-1]
+
+    def _depth_limit(self):
+        """Return the number of levels of constructed values that can still
+        be entered below the current window, as enter() counts them."""
+        return self.m_max_depth - len(self.m_stack) + 1
+
+    def _indefinite_length(self, tag):
+        """Return the length of the contents of the indefinite length value
+        with tag `tag` at the current position, not including the
+        end-of-contents octets."""
+        if tag[1] != TypeConstructed:
+            raise Error('ASN1 syntax error')
+        index, end = self.m_stack[-1]
+        max_depth = self.m_max_depth - len(self.m_stack)
+        return _end_of_contents(self.m_input, index, end, max_depth) - index
+
+    def _decode_value(self, tag, bytes_data):
+        """Decode a value."""
+        if tag[1] == TypePrimitive:
+            decode = _decoders.get((tag[2], tag[0]))
+            if decode is not None:
+                if self.m_check and tag[2] == ClassUniversal:
+                    self._check_value(tag[0], bytes_data)
+                return decode(bytes_data)
+        return bytes_data
+
+    def _check_value(self, nr, bytes_data):
+        """Check the size limits of the value of universal type `nr`."""
+        if nr == Integer or nr == Enumerated:
+            limit = self.m_max_integer
+            if limit is not None and len(bytes_data) > limit:
+                raise Error('Integer size exceeds limit.')
+        elif nr == Real:
+            # The exponent and mantissa of the binary form are integers.
+            limit = self.m_max_integer
+            if limit is not None and len(bytes_data) > limit + 1 and \
+                    bytes_data[0] & 0x80:
+                count = (bytes_data[0] & 0x03) + 1
+                pos = 1
+                if count == 4:
+                    count = bytes_data[1]
+                    pos = 2
+                if count > limit or len(bytes_data) - pos - count > limit:
+                    raise Error('Real size exceeds limit.')
         elif nr == ObjectIdentifier:
-            value = self._decode_object_identifier(bytes_data)
-        else:
-            value = bytes_data
-        return value
+            limit = self.m_max_arc
+            if limit is not None and len(bytes_data) > limit:
+                size = 0
+                for byte in bytes_data:
+                    size += 1
+                    if size > limit:
+                        raise Error('Object identifier arc exceeds limit.')
+                    if not byte & 0x80:
+                        size = 0
 
     def _read_byte(self):
         """Return the next input byte, or raise an error on end-of-input."""
-        index, input_data = self.m_stack[-1]
-        try:
-            byte = input_data[index]
-        except IndexError:
-            raise Error('Premature end of input.')
-        self.m_stack[-1][0] += 1
-        return byte
+        frame = self.m_stack[-1]
+        index = frame[0]
+        if index >= frame[1]:
+            raise _PrematureEnd()
+        frame[0] = index + 1
+        return self.m_input[index]
 
     def _read_bytes(self, count):
         """Return the next `count` bytes of input. Raise error on
         end-of-input."""
-        index, input_data = self.m_stack[-1]
-        bytes_data = input_data[index:index+count]
-        if len(bytes_data) != count:
-            raise Error('Premature end of input.')
-        self.m_stack[-1][0] += count
-        return bytes_data
+        frame = self.m_stack[-1]
+        index = frame[0]
+        if index + count > frame[1]:
+            raise _PrematureEnd(index + count - frame[1])
+        frame[0] = index + count
+        return self.m_input[index:index+count]
+
+    def _skip_bytes(self, count):
+        """Move over the next `count` bytes of input. Raise error on
+        end-of-input."""
+        frame = self.m_stack[-1]
+        index = frame[0]
+        if index + count > frame[1]:
+            raise _PrematureEnd(index + count - frame[1])
+        frame[0] = index + count
 
     def _end_of_input(self):
         """Return True if we are at the end of input."""
-        index, input_data = self.m_stack[-1]
-        assert not index > len(input_data)
-        return index == len(input_data)
-
-    def _decode_integer(self, bytes_data):
-        """Decode an integer value."""
-        values = [int(b) for b in bytes_data]
-        # check if the integer is normalized
-        if len(values) > 1 and \
-                (values[0] == 0xff and values[1] & 0x80 or
-                 values[0] == 0x00 and not (values[1] & 0x80)):
-            raise Error('ASN1 syntax error')
-        negative = values[0] & 0x80
-        if negative:
-            # make positive by taking two's complement
-            for i in range(len(values)):
-                values[i] = 0xff - values[i]
-            for i in range(len(values) - 1, -1, -1):
-                values[i] += 1
-                if values[i] <= 0xff:
+        index, end = self.m_stack[-1]
+        assert not index > end
+        return index == end
+
+
+class Path(object):
+    """A compiled path to a record, for Decoder.select().
+
+    Each element of the path selects a child of the record selected by the
+    previous element; the first element selects a record at the current
+    decoding position. An element can be:
+
+     * an int `n`: the n-th record (counting from 0);
+     * a list `[n]`: the first record with context class tag number `n`;
+     * a tuple `(nr, cls)`: the first record with that number and class;
+     * a tuple `(nr, typ, cls)`: the first record with that tag.
+    """
+
+    def __init__(self, path):
+        """Compile `path`."""
+        steps = []
+        for elem in path:
+            if isinstance(elem, int):
+                steps.append((elem, None, None, None))
+            elif isinstance(elem, list) and len(elem) == 1:
+                steps.append((None, elem[0], None, ClassContext))
+            elif isinstance(elem, tuple) and len(elem) == 2:
+                steps.append((None, elem[0], None, elem[1]))
+            elif isinstance(elem, tuple) and len(elem) == 3:
+                steps.append((None, elem[0], elem[1], elem[2]))
+            else:
+                raise Error('Illegal path element: %r' % (elem,))
+        if not steps:
+            raise Error('Empty path')
+        self.m_steps = tuple(steps)
+
+
+class StreamDecoder(object):
+    """An incremental ASN.1 decoder for input that arrives in chunks.
+
+    Input is passed in with feed(), which returns everything that the new
+    data completed. By default these are the encodings of the complete
+    top-level TLV records, as bytes. If `events` is true, the input is
+    reported as (kind, tag, value, depth, offset) tuples instead, where kind
+    is one of EventStart, EventValue or EventEnd and offset is the position
+    of the TLV record in the stream. Start events are returned as soon as
+    the header of a constructed value has arrived. Only the bytes of the
+    unfinished record are kept in the buffer, and input that has been
+    parsed once is never parsed again.
+    """
+
+    def __init__(self, events=False):
+        """Constructor."""
+        self.m_events = events
+        self.m_decoder = Decoder()
+        self.m_buffer = bytearray()
+        self.m_offset = 0
+        self.m_header = None
+        self.m_stack = []
+
+    def feed(self, data):
+        """Add `data` to the input. Return a list of the completed records
+        or events."""
+        buf = self.m_buffer
+        buf += data
+        stack = self.m_stack
+        result = []
+        pos = 0
+        while True:
+            offset = self.m_offset + pos
+            while stack and stack[-1][0] == offset:
+                end, tag, start = stack.pop()
+                result.append((EventEnd, tag, None, len(stack), start))
+            if pos == len(buf):
+                break
+            header = self.m_header
+            if header is None:
+                header = self._read_header(pos)
+                if header is None:
                     break
-                assert i > 0
-                values[i] = 0x00
-        value = 0
-        for val in values:
-            value = (value << 8) | val
-        if negative:
-            value = -value
+                self.m_header = header
+            tag, length, size = header
+            if stack and offset + size + length > stack[-1][0]:
+                raise Error('ASN1 syntax error')
+            if self.m_events and tag[1] == TypeConstructed:
+                result.append((EventStart, tag, None, len(stack), offset))
+                stack.append((offset + size + length, tag, offset))
+                pos += size
+            elif pos + size + length > len(buf):
+                break
+            elif self.m_events:
+                value = buf[pos+size:pos+size+length]
+                value = self.m_decoder._decode_value(tag, bytes(value))
+                result.append((EventValue, tag, value, len(stack), offset))
+                pos += size + length
+            else:
+                result.append(bytes(buf[pos:pos+size+length]))
+                pos += size + length
+            self.m_header = None
+        if pos:
+            del buf[:pos]
+            self.m_offset += pos
+        return result
+
+    def eof(self):
+        """Return True if no partial record is pending."""
+        return not self.m_buffer and not self.m_stack
+
+    def _read_header(self, pos):
+        """Parse the tag and length at `pos` in the buffer. Return a (tag,
+        length, size) tuple, or None if the header is not complete yet."""
+        dec = self.m_decoder
+        dec.start(self.m_buffer)
+        dec.m_stack[0][0] = pos
         try:
-            value = int(value)
-        except OverflowError:
-            pass
-        return value
+            tag = dec._read_tag()
+            length = dec._read_length()
+        except _PrematureEnd:
+            return None
+        if length is None:
+            raise Error('Indefinite length not supported.')
+        return (tag, length, dec.m_stack[0][0] - pos)
 
-    def _decode_octet_string(self, bytes_data):
-        """Decode an octet string."""
-        return bytes_data
 
-    def _decode_null(self, bytes_data):
-        """Decode a Null value."""
-        if len(bytes_data) != 0:
+class Index(object):
+    """A header-only index of all TLV records in a buffer.
+
+    The buffer is scanned once, reading only tags and lengths. Every record
+    becomes a node, numbered in document order, whose tag, header offset,
+    value offset, length, depth and parent are stored in flat arrays. Values
+    are only decoded when asked for with read().
+    """
+
+    def __init__(self, data, view=False):
+        """Scan `data`. If `view` is true, raw values are returned as views
+        into `data`, like Decoder.start() does."""
+        dec = Decoder()
+        dec.start(data, view)
+        self.m_decoder = dec
+        self.m_nr = nrs = array('q')
+        self.m_id = ids = array('B')
+        self.m_header = headers = array('q')
+        self.m_value = values = array('q')
+        self.m_length = lengths = array('q')
+        self.m_depth = depths = array('l')
+        self.m_parent = parents = array('q')
+        self.m_next = nexts = array('q')
+        add_nr, add_id = nrs.append, ids.append
+        add_header, add_value = headers.append, values.append
+        add_length, add_depth = lengths.append, depths.append
+        add_parent, add_next = parents.append, nexts.append
+        data = dec.m_input
+        frame = dec.m_stack[0]
+        end = frame[1]
+        limit = end
+        parent = -1
+        stack = []
+        pos = 0
+        node = -1
+        while True:
+            while pos == limit and stack:
+                nexts[parent] = node + 1
+                stack.pop()
+                if stack:
+                    limit, parent = stack[-1]
+                else:
+                    limit, parent = end, -1
+            if pos == end:
+                break
+            byte = data[pos]
+            if byte & 0x1f != 0x1f and pos + 1 < limit and \
+                    not data[pos+1] & 0x80:
+                # Fast path for the common short tag and short length.
+                nr = byte & 0x1f
+                typ = byte & 0x20
+                cls = byte & 0xc0
+                length = data[pos+1]
+                offset = pos + 2
+            else:
+                frame[0] = pos
+                nr, typ, cls = dec._read_tag()
+                length = dec._read_length()
+                if length is None:
+                    raise Error('Indefinite length not supported.')
+                offset = frame[0]
+            if offset + length > limit:
+                raise Error('Premature end of input.')
+            node += 1
+            add_nr(nr)
+            add_id(typ | cls)
+            add_header(pos)
+            add_value(offset)
+            add_length(length)
+            add_depth(len(stack))
+            add_parent(parent)
+            add_next(node + 1)
+            if typ == TypeConstructed:
+                limit = offset + length
+                parent = node
+                stack.append((limit, parent))
+                pos = offset
+            else:
+                pos = offset + length
+
+    def __len__(self):
+        """Return the number of nodes."""
+        return len(self.m_nr)
+
+    def tag(self, node):
+        """Return the (nr, typ, cls) tag of `node`."""
+        ident = self.m_id[node]
+        return (self.m_nr[node], ident & 0x20, ident & 0xc0)
+
+    def node(self, node):
+        """Return a (tag, header offset, value offset, length, depth,
+        parent) tuple for `node`. The parent of a top-level node is -1."""
+        return (self.tag(node), self.m_header[node], self.m_value[node],
+                self.m_length[node], self.m_depth[node], self.m_parent[node])
+
+    def parent(self, node):
+        """Return the parent of `node`, or -1 for a top-level node."""
+        return self.m_parent[node]
+
+    def next(self, node):
+        """Return the node following `node` and all its descendants. This
+        is the next sibling of `node`, if it has one."""
+        return self.m_next[node]
+
+    def children(self, node=-1):
+        """Iterate over the children of `node`. By default, iterate over
+        the top-level nodes."""
+        parents = self.m_parent
+        count = len(parents)
+        child = node + 1
+        while child < count and parents[child] == node:
+            yield child
+            child = self.m_next[child]
+
+    def raw(self, node):
+        """Return the complete encoding (header and value) of `node`."""
+        end = self.m_value[node] + self.m_length[node]
+        return self.m_decoder.m_input[self.m_header[node]:end]
+
+    def read(self, node):
+        """Decode `node` and return a (tag, value) tuple, like
+        Decoder.read() does."""
+        offset = self.m_value[node]
+        data = self.m_decoder.m_input[offset:offset+self.m_length[node]]
+        tag = self.tag(node)
+        return (tag, self.m_decoder._decode_value(tag, data))
+
+
+class RecordFile(object):
+    """A file of back-to-back TLV records with a sidecar offset index.
+
+    The index is kept in the file `index`, which defaults to the path of the
+    record file with '.idx' appended. It consists of the magic b'UASN1IX1'
+    followed by the end offset of every record as a little endian 64-bit
+    integer. When the record file is opened, records that are not in the
+    index yet are found by scanning their headers and added to it; a
+    partial record at the end of the file is left for a later open. The
+    index is rebuilt if it does not match the record file. Records are
+    read from a memory mapping of the file.
+    """
+
+    magic = b'UASN1IX1'
+
+    def __init__(self, path, index=None):
+        """Open the record file `path`."""
+        if index is None:
+            index = path + '.idx'
+        self.m_path = path
+        self.m_index = index
+        self.m_ends = array('q')
+        self.m_decoder = Decoder()
+        self.m_retired = []
+        self.m_size = 0
+        # Create the record file if it does not exist yet.
+        open(path, 'ab').close()
+        self._update(self._load())
+
+    def __len__(self):
+        """Return the number of records."""
+        return len(self.m_ends)
+
+    def raw(self, record):
+        """Return the complete encoding of record number `record`, as a view
+        into the file."""
+        ends = self.m_ends
+        end = ends[record]
+        if record < 0:
+            record += len(ends)
+        start = record and ends[record-1] or 0
+        if end > self.m_size:
+            self._map()
+        return self.m_decoder.m_input[start:end]
+
+    def decoder(self, record):
+        """Return a Decoder that is started on record number `record`."""
+        dec = Decoder()
+        dec.start(self.raw(record))
+        return dec
+
+    def append(self, data):
+        """Append the encoded record `data` to the file and the index."""
+        dec = Decoder()
+        dec.start(data)
+        if dec.skip() is None or not dec.eof():
+            raise Error('Data is not a single record.')
+        ends = self.m_ends
+        end = (ends and ends[-1] or 0) + len(data)
+        with open(self.m_path, 'ab') as fobj:
+            if fobj.seek(0, 2) + len(data) != end:
+                raise Error('Record file does not match its index.')
+            fobj.write(data)
+        with open(self.m_index, 'ab') as fobj:
+            fobj.write(end.to_bytes(8, 'little'))
+        ends.append(end)
+
+    def close(self):
+        """Close the file. All views into it must have been released."""
+        self.m_decoder.close()
+        self.m_size = 0
+        while self.m_retired:
+            self.m_retired[-1].close()
+            del self.m_retired[-1]
+
+    def _load(self):
+        """Load the index. Return False if there is no valid index."""
+        try:
+            with open(self.m_index, 'rb') as fobj:
+                data = fobj.read()
+        except OSError:
+            return False
+        if data[:8] != self.magic or len(data) % 8:
+            return False
+        ends = array('q')
+        ends.frombytes(data[8:])
+        if sys.byteorder != 'little':
+            ends.byteswap()
+        self.m_ends = ends
+        return True
+
+    def _map(self):
+        """Map the record file into memory. Earlier mappings are kept until
+        all views into them have been released."""
+        dec = self.m_decoder
+        if dec.m_input is not None:
+            self.m_retired.append(dec)
+            self.m_decoder = dec = Decoder()
+        retired = []
+        for old in self.m_retired:
+            try:
+                old.close()
+            except Error:
+                retired.append(old)
+        self.m_retired = retired
+        dec.open(self.m_path)
+        self.m_size = len(dec.m_input)
+
+    def _update(self, valid):
+        """Add the records that are not in the index yet. If `valid` is
+        false, the index file is rewritten."""
+        self._map()
+        size = self.m_size
+        if self.m_ends and self.m_ends[-1] > size:
+            valid = False
+        if not valid:
+            self.m_ends = array('q')
+        ends = self.m_ends
+        count = len(ends)
+        pos = count and ends[-1] or 0
+        dec = self.m_decoder
+        frame = dec.m_stack[0]
+        while pos < size:
+            frame[0] = pos
+            try:
+                dec.skip()
+            except _PrematureEnd:
+                break
+            pos = frame[0]
+            ends.append(pos)
+        if not valid:
+            with open(self.m_index, 'wb') as fobj:
+                fobj.write(self.magic)
+                fobj.write(self._pack(ends))
+        elif len(ends) > count:
+            with open(self.m_index, 'ab') as fobj:
+                fobj.write(self._pack(ends[count:]))
+
+    def _pack(self, ends):
+        """Return `ends` as little endian 64-bit integers."""
+        ends = array('q', ends)
+        if sys.byteorder != 'little':
+            ends.byteswap()
+        return ends.tobytes()
+
+
+def _length_at(data, index, end):
+    """Read the length octets at `index` in `data`, which must not extend
+    beyond `end`. Return (length, index of the value)."""
+    if index >= end:
+        raise _PrematureEnd()
+    length = data[index]
+    index += 1
+    if length & 0x80:
+        count = length & 0x7f
+        if count == 0x7f:
             raise Error('ASN1 syntax error')
-        return None
+        if count == 0:
+            raise Error('Indefinite length not supported.')
+        if index + count > end:
+            raise _PrematureEnd(index + count - end)
+        length = 0
+        for i in range(index, index + count):
+            length = (length << 8) | data[i]
+        index += count
+    if index + length > end:
+        raise _PrematureEnd(index + length - end)
+    return length, index
 
-    def _decode_object_identifier(self, bytes_data):
-        """Decode an object identifier."""
-        result = []
-        value = 0
-        for i in range(len(bytes_data)):
-            byte = int(bytes_data[i])
-            if value == 0 and byte == 0x80:
+
+def _tlv_end_at(data, index, end):
+    """Return the end of the TLV record at `index` in `data`."""
+    if index >= end:
+        raise _PrematureEnd()
+    if data[index] & 0x1f == 0x1f:
+        index += 1
+        while index < end and data[index] & 0x80:
+            index += 1
+    length, index = _length_at(data, index + 1, end)
+    return index + length
+
+
+def _header_at(data, index, end):
+    """Read the header at `index` in `data`, which must not extend beyond
+    `end`. Return a (tag, length, index of the value) tuple, where length is
+    None for the indefinite length form."""
+    byte = data[index]
+    tag = _short_tags[byte]
+    index += 1
+    if tag is None:
+        nr = 0
+        while True:
+            if index >= end:
+                raise _PrematureEnd()
+            octet = data[index]
+            index += 1
+            nr = (nr << 7) | (octet & 0x7f)
+            if not octet & 0x80:
+                break
+        tag = (nr, byte & 0x20, byte & 0xc0)
+    if index < end and data[index] == 0x80:
+        return tag, None, index + 1
+    length, index = _length_at(data, index, end)
+    return tag, length, index
+
+
+def decode_all(data, view=False):
+    """Decode all records in `data` in a single pass, and return them as a
+    list of (tag, value) tuples.
+
+    The values of primitive records are the same as Decoder.read() returns.
+    The value of a constructed record is the list of its children, as
+    Decoder.enter() would find them. If `view` is true, raw values are
+    views into `data`, like Decoder.start() does.
+    """
+    if view:
+        data = memoryview(data)
+    tags = _short_tags
+    eoc = tags[0]
+    get_decoder = _decoders.get
+    result = items = []
+    # (limit, items, indefinite) of the open constructed values.
+    stack = []
+    limit = len(data)
+    pos = 0
+    while True:
+        while pos == limit and stack:
+            limit, items, indefinite = stack.pop()
+            if indefinite:
+                raise _PrematureEnd(2)
+        if pos == limit:
+            return result
+        tag = tags[data[pos]]
+        if tag is not None and pos + 1 < limit and data[pos+1] < 0x80:
+            # Fast path for the common short tag and short length.
+            length = data[pos+1]
+            pos += 2
+        else:
+            tag, length, pos = _header_at(data, pos, limit)
+            if tag is eoc:
+                # End-of-contents octets are exactly 00 00, which the fast
+                # path above reads.
+                raise Error('ASN1 syntax error')
+        if tag[1]:
+            children = []
+            items.append((tag, children))
+            if length is None:
+                stack.append((limit, items, True))
+            else:
+                if pos + length > limit:
+                    raise _PrematureEnd(pos + length - limit)
+                stack.append((limit, items, False))
+                limit = pos + length
+            items = children
+            continue
+        if tag is eoc:
+            if length != 0 or not stack or not stack[-1][2]:
                 raise Error('ASN1 syntax error')
-            value = (value << 7) | (byte & 0x7f)
-            if not byte & 0x80:
-                result.append(value)
-                value = 0
-        if len(result) == 0 or result[0] > 1599:
+            limit, items, indefinite = stack.pop()
+            continue
+        if length is None:
             raise Error('ASN1 syntax error')
-        result = [result[0] // 40, result[0] % 40] + result[1:]
-        result = list(map(str, result))
-        return '.'.join(result)
\ No newline at end of file
+        end = pos + length
+        if end > limit:
+            raise _PrematureEnd(end - limit)
+        value = data[pos:end]
+        decode = get_decoder((tag[2], tag[0]))
+        if decode is not None:
+            value = decode(value)
+        items.append((tag, value))
+        pos = end
+
+
+def decode(data, view=False):
+    """Decode the single record in `data` and return it as a (tag, value)
+    tuple, like decode_all() does.
+
+    This function and encode() keep all their state in local variables, so
+    they can be called from several threads at the same time. They share
+    only the codec registry and the object identifier cache, which are
+    safe to use concurrently; register codecs before starting threads.
+    """
+    items = decode_all(data, view)
+    if len(items) != 1:
+        raise Error('Expecting a single record, found %d.' % len(items))
+    return items[0]
+
+
+def encode(items):
+    """Encode a list of (tag, value) tuples, as returned by decode_all(),
+    and return the encoding as bytes. Constructed values can be lists of
+    children, or their encoded contents. See decode() for thread safety."""
+    enc = Encoder()
+    enc.start()
+    stack = []
+    children = iter(items)
+    while True:
+        for tag, value in children:
+            nr, typ, cls = tag
+            if typ == TypeConstructed and isinstance(value, list):
+                enc.enter(nr, cls)
+                stack.append(children)
+                children = iter(value)
+                break
+            enc.write(value, nr, typ, cls)
+        else:
+            if not stack:
+                return enc.output()
+            enc.leave()
+            children = stack.pop()
+
+
+def patch(data, path, value, raw=False):
+    """Replace the record at `path` in the encoding `data`, and fix up the
+    lengths of the records that contain it.
+
+    The path is a Path, or a sequence that is converted into one, and is
+    followed from the first record in `data` like Decoder.select() does.
+    The new value is encoded with the tag of the old record, like
+    Encoder.write() does, or is a complete encoded record if `raw` is true.
+    Only the record and the length octets of the enclosing records are
+    rewritten, switching between the short and long length forms where
+    needed, so the result is the same as encoding the changed data again.
+    A bytearray is changed in place and returned; for other input, new
+    bytes are returned.
+    """
+    if not isinstance(path, Path):
+        path = Path(path)
+    steps = path.m_steps
+    last = len(steps) - 1
+    # (offset of the length octets, offset of the contents, length) of the
+    # enclosing records.
+    parents = []
+    index = 0
+    end = len(data)
+    for i in range(len(steps)):
+        position, nr, typ, cls = steps[i]
+        count = 0
+        while True:
+            if index >= end:
+                raise Error('No record at path.')
+            offset = index
+            tag, length, index = _header_at(data, offset, end)
+            if length is None:
+                raise Error('Indefinite length not supported.')
+            if (position is None or position == count) and \
+                    (nr is None or nr == tag[0]) and \
+                    (typ is None or typ == tag[1]) and \
+                    (cls is None or cls == tag[2]):
+                break
+            if position is not None and count >= position:
+                raise Error('No record at path.')
+            index += length
+            count += 1
+        if i == last:
+            break
+        if tag[1] != TypeConstructed:
+            raise Error('No record at path.')
+        start = offset + 1
+        if data[offset] & 0x1f == 0x1f:
+            while data[start] & 0x80:
+                start += 1
+            start += 1
+        parents.append((start, index, length))
+        end = index + length
+    if raw:
+        record = value
+    else:
+        enc = Encoder()
+        enc.start()
+        enc.write(value, tag[0], tag[1], tag[2])
+        record = enc.output()
+    # The edits are made from the end of the data to the start, so that
+    # the offsets of the remaining edits stay valid.
+    edits = [(offset, index + length, record)]
+    delta = len(record) - (index + length - offset)
+    for start, index, length in reversed(parents):
+        if not delta:
+            break
+        length += delta
+        if length < 128:
+            octets = bytes((length,))
+        else:
+            octets = _long_length(length)
+        edits.append((start, index, octets))
+        delta += len(octets) - (index - start)
+    if isinstance(data, bytearray):
+        for start, stop, octets in edits:
+            data[start:stop] = octets
+        return data
+    data = memoryview(data)
+    parts = []
+    index = 0
+    for start, stop, octets in reversed(edits):
+        parts.append(data[index:start])
+        parts.append(octets)
+        index = stop
+    parts.append(data[index:])
+    return b''.join(parts)
+
+
+_re_base64 = re.compile(b'^[A-Za-z0-9+/]*=?=?$')
+
+
+def _decode_pem(buf, size, text, final):
+    """Decode the base64 `text` into `buf` at `size`. Return the buffer,
+    which is replaced when it is too small, the new size, and the trailing
+    characters that do not make up a 4 character group. Unless `final` is
+    true, a padded group is also returned, so that text after the padding
+    is found by the next call."""
+    text = b''.join(text.split())
+    if not _re_base64.match(text):
+        raise Error('Invalid base64 data in PEM block.')
+    count = len(text) & ~3
+    if not final and count and text[count-1:count] == b'=':
+        count -= 4
+    try:
+        chunk = binascii.a2b_base64(text[:count])
+    except (ValueError, TypeError):
+        raise Error('Invalid base64 data in PEM block.')
+    end = size + len(chunk)
+    if end > len(buf):
+        # Views of the old buffer may still be alive, so do not resize it.
+        new = bytearray(max(2 * len(buf), end))
+        new[:size] = memoryview(buf)[:size]
+        buf = new
+    buf[size:end] = chunk
+    return buf, end, text[count:]
+
+
+def read_pem(fileobj):
+    """Read the PEM blocks (RFC 7468) from the file object `fileobj`, which
+    can be opened in binary or text mode. Generate a (label, data) tuple
+    for every block, where label is e.g. 'CERTIFICATE' and data is a
+    memoryview of the decoded DER encoding.
+
+    The base64 text is decoded a few hundred lines at a time into a buffer
+    that is reused for the next block, so a view is only valid until the
+    next iteration; use bytes() to keep it. Text outside of the blocks and
+    RFC 1421 header lines are skipped.
+    """
+    buf = bytearray(4096)
+    size = 0
+    label = None
+    lines = []
+    pending = b''
+    for line in fileobj:
+        if not isinstance(line, bytes):
+            line = line.encode('utf-8')
+        if label is None:
+            line = line.strip()
+            if line.startswith(b'-----BEGIN ') and line.endswith(b'-----'):
+                label = line[11:-5]
+                header = True
+                size = 0
+            continue
+        if line[:1] != b'-':
+            if header:
+                if b':' in line:
+                    continue
+                header = False
+            lines.append(line)
+            if len(lines) == 256:
+                buf, size, pending = _decode_pem(buf, size,
+                                                 pending + b''.join(lines),
+                                                 False)
+                lines = []
+            continue
+        line = line.strip()
+        if not line.startswith(b'-----END ') or line[9:-5] != label or \
+                not line.endswith(b'-----'):
+            raise Error('PEM end line does not match "%s".' %
+                        label.decode())
+        buf, size, pending = _decode_pem(buf, size, pending + b''.join(lines),
+                                         True)
+        if pending:
+            raise Error('Invalid base64 data in PEM block.')
+        lines = []
+        yield label.decode(), memoryview(buf)[:size]
+        label = None
+    if label is not None:
+        raise Error('Unterminated PEM block "%s".' % label.decode())
+
+
+def write_pem(fileobj, label, data):
+    """Write `data` to the binary file object `fileobj` as one PEM block
+    with the label `label`, in lines of 64 characters."""
+    data = memoryview(data)
+    label = label.encode('utf-8')
+    lines = [b'-----BEGIN ' + label + b'-----\n']
+    for index in range(0, len(data), 48):
+        lines.append(binascii.b2a_base64(data[index:index+48]))
+    lines.append(b'-----END ' + label + b'-----\n')
+    fileobj.write(b''.join(lines))
+
+
+class Schema(object):
+    """An encoder and decoder for one ASN.1 type, compiled from a
+    declarative description.
+
+    The description is compiled once into a pair of Python functions that
+    encode and decode the type with straight-line code, in which all tags
+    are constants. A description is one of:
+
+     * a universal type number, e.g. Integer, for a primitive value;
+     * 'any', for any single record, as its complete encoding;
+     * ('sequence', fields) or ('set', fields), for a dict;
+     * ('sequence of', type) or ('set of', type), for a list;
+     * ('choice', fields), for a (name, value) tuple;
+     * ('implicit', tag, type) or ('explicit', tag, type), for a tagged
+       type. The tag is a context class number, or a (nr, cls) tuple.
+
+    A field is a (name, type) or (name, type, options) tuple, where options
+    is a dict that contains 'optional': True or 'default': value. Absent
+    optional fields decode to None, and None values are not encoded.
+    Values equal to their default are not encoded either. The fields of a
+    set are encoded in the canonical order of their tags, as DER requires.
+    Recursive types are not supported.
+    """
+
+    def __init__(self, spec):
+        """Compile `spec`."""
+        compiler = _SchemaCompiler()
+        node = compiler.parse(spec)
+        self.m_source = compiler.compile(node)
+        namespace = dict(compiler.m_constants)
+        exec(self.m_source, namespace)
+        self.m_encode = namespace['encode']
+        self.m_decode = namespace['decode']
+
+    def encode(self, value):
+        """Encode `value` and return the encoding as bytes."""
+        buf = bytearray()
+        self.m_encode(buf, value)
+        return bytes(buf)
+
+    def decode(self, data):
+        """Decode the single record in `data` and return its value. Raw
+        values are views into `data` if it is a memoryview."""
+        value, index = self.m_decode(data, 0, len(data))
+        if index != len(data):
+            raise Error('ASN1 syntax error')
+        return value
+
+
+class _SchemaCompiler(object):
+    """Compiles a Schema description into Python source code."""
+
+    def __init__(self):
+        """Constructor."""
+        self.m_constants = {
+            'Error': Error,
+            '_length_at': _length_at,
+            '_tlv_end_at': _tlv_end_at,
+            '_patch_length': _patch_length,
+            '_long_length': _long_length,
+        }
+        self.m_count = 0
+
+    def parse(self, spec):
+        """Return the node for the description `spec`. A node is a
+        (kind, identifier octets, arguments) tuple."""
+        if isinstance(spec, int):
+            return ('primitive', self._ident(spec, TypePrimitive,
+                                             ClassUniversal), spec)
+        if spec == 'any':
+            return ('any', None, None)
+        if not isinstance(spec, tuple) or not spec:
+            raise Error('Illegal schema: %r' % (spec,))
+        kind = spec[0]
+        if kind in ('sequence', 'set', 'choice') and len(spec) == 2:
+            fields = [self._field(field) for field in spec[1]]
+            if kind == 'choice':
+                return ('choice', None, fields)
+            nr = kind == 'set' and Set or Sequence
+            return (kind, self._ident(nr, TypeConstructed, ClassUniversal),
+                    fields)
+        if kind in ('sequence of', 'set of') and len(spec) == 2:
+            nr = kind == 'set of' and Set or Sequence
+            return ('sequence of',
+                    self._ident(nr, TypeConstructed, ClassUniversal),
+                    self.parse(spec[1]))
+        if kind in ('implicit', 'explicit') and len(spec) == 3:
+            tag = spec[1]
+            if isinstance(tag, int):
+                tag = (tag, ClassContext)
+            node = self.parse(spec[2])
+            if kind == 'explicit':
+                return ('explicit',
+                        self._ident(tag[0], TypeConstructed, tag[1]), node)
+            if node[1] is None:
+                raise Error('Cannot implicitly tag an untagged type')
+            typ = node[1][0] & TypeConstructed
+            return (node[0], self._ident(tag[0], typ, tag[1]), node[2])
+        raise Error('Illegal schema: %r' % (spec,))
+
+    def compile(self, node):
+        """Return the source code of the encode and decode functions."""
+        lines = ['def encode(b, v0):']
+        self._encode(node, 'v0', lines, 1)
+        lines.append('def decode(data, i0, e0):')
+        self._decode(node, 'r0', 'i0', 'e0', lines, 1)
+        lines.append('    return r0, i0')
+        return '\n'.join(lines) + '\n'
+
+    def _field(self, field):
+        """Parse a field."""
+        if not isinstance(field, tuple) or len(field) not in (2, 3):
+            raise Error('Illegal schema field: %r' % (field,))
+        options = len(field) == 3 and field[2] or {}
+        return (field[0], self.parse(field[1]),
+                options.get('optional', False) or 'default' in options,
+                options.get('default'))
+
+    def _ident(self, nr, typ, cls):
+        """Return the identifier octets of a tag."""
+        enc = Encoder()
+        enc.start()
+        enc._emit_tag(nr, typ, cls)
+        return bytes(enc.m_buffer)
+
+    def _name(self, prefix):
+        """Return a new unique name."""
+        self.m_count += 1
+        return '%s%d' % (prefix, self.m_count)
+
+    def _constant(self, value):
+        """Return the name of a new constant with value `value`."""
+        name = self._name('K')
+        self.m_constants[name] = value
+        return name
+
+    def _first(self, node):
+        """Return the identifier octets that `node` can start with, or None
+        if it can start with any."""
+        if node[0] == 'any':
+            return None
+        if node[0] == 'choice':
+            idents = []
+            for field in node[2]:
+                first = self._first(field[1])
+                if first is None:
+                    return None
+                idents += first
+            return idents
+        return [node[1]]
+
+    def _order(self, field):
+        """Return the key that sorts the fields of a set in the canonical
+        order of their tags, by class and then by number. An untagged
+        choice is sorted by the lowest tag of its alternatives."""
+        idents = self._first(field[1])
+        if idents is None:
+            raise Error('Untagged ANY in a SET')
+        keys = []
+        for ident in idents:
+            nr = ident[0] & 0x1f
+            if nr == 0x1f:
+                nr = 0
+                for octet in ident[1:]:
+                    nr = (nr << 7) | (octet & 0x7f)
+            keys.append((ident[0] & 0xc0, nr))
+        return min(keys)
+
+    def _match(self, idents, index, end):
+        """Return an expression that tests whether the record at `index`
+        starts with one of `idents`."""
+        if idents is None:
+            return '%s < %s' % (index, end)
+        tests = []
+        short = [ident[0] for ident in idents if len(ident) == 1]
+        if len(short) == 1:
+            tests.append('data[%s] == %d' % (index, short[0]))
+        elif short:
+            tests.append('data[%s] in %r' % (index, tuple(short)))
+        for ident in idents:
+            if len(ident) > 1:
+                tests.append('data[%s:%s+%d] == %s' % (
+                    index, index, len(ident), self._constant(ident)))
+        return '%s < %s and (%s)' % (index, end, ' or '.join(tests))
+
+    def _encode(self, node, value, lines, depth):
+        """Generate code that appends the encoding of `value` to b."""
+        pad = '    ' * depth
+        kind, ident = node[0], node[1]
+        if kind == 'any':
+            lines.append('%sb += %s' % (pad, value))
+            return
+        if kind == 'choice':
+            name, item = self._name('n'), self._name('v')
+            lines.append('%s%s, %s = %s' % (pad, name, item, value))
+            test = 'if'
+            for field in node[2]:
+                lines.append('%s%s %s == %r:' % (pad, test, name, field[0]))
+                self._encode(field[1], item, lines, depth + 1)
+                test = 'elif'
+            lines.append('%selse:' % pad)
+            lines.append("%s    raise Error('Unknown choice: %%r' %% (%s,))"
+                         % (pad, name))
+            return
+        lines.append('%sb += %s' % (pad, self._constant(ident)))
+        if kind == 'primitive':
+            encode = _encoders.get((ClassUniversal, node[2]))
+            octets = self._name('c')
+            if encode is None:
+                lines.append('%s%s = %s' % (pad, octets, value))
+            else:
+                lines.append('%s%s = %s(%s)' % (pad, octets,
+                                                self._constant(encode), value))
+            length = self._name('n')
+            lines.append('%s%s = len(%s)' % (pad, length, octets))
+            lines.append('%sif %s < 128:' % (pad, length))
+            lines.append('%s    b.append(%s)' % (pad, length))
+            lines.append('%selse:' % pad)
+            lines.append('%s    b += _long_length(%s)' % (pad, length))
+            lines.append('%sb += %s' % (pad, octets))
+            return
+        start = self._name('p')
+        lines.append('%sb.append(0)' % pad)
+        lines.append('%s%s = len(b)' % (pad, start))
+        if kind == 'explicit':
+            self._encode(node[2], value, lines, depth)
+        elif kind == 'sequence of':
+            item = self._name('v')
+            lines.append('%sfor %s in %s:' % (pad, item, value))
+            self._encode(node[2], item, lines, depth + 1)
+        else:
+            fields = node[2]
+            if kind == 'set':
+                fields = sorted(fields, key=self._order)
+            for name, child, optional, default in fields:
+                item = self._name('v')
+                if not optional:
+                    lines.append('%s%s = %s[%r]' % (pad, item, value, name))
+                    self._encode(child, item, lines, depth)
+                    continue
+                lines.append('%s%s = %s.get(%r)' % (pad, item, value, name))
+                if default is None:
+                    lines.append('%sif %s is not None:' % (pad, item))
+                else:
+                    lines.append('%sif %s is not None and %s != %s:' % (
+                        pad, item, item, self._constant(default)))
+                self._encode(child, item, lines, depth + 1)
+        lines.append('%s_patch_length(b, %s)' % (pad, start))
+
+    def _decode(self, node, result, index, end, lines, depth, matched=False):
+        """Generate code that decodes the record at `index`, which must end
+        before `end`, into `result` and moves `index` past it. If `matched`
+        is true, the tag of the record has already been checked."""
+        pad = '    ' * depth
+        kind, ident = node[0], node[1]
+        if kind == 'any':
+            stop = self._name('e')
+            lines.append('%s%s = _tlv_end_at(data, %s, %s)' % (
+                pad, stop, index, end))
+            lines.append('%s%s = data[%s:%s]' % (pad, result, index, stop))
+            lines.append('%s%s = %s' % (pad, index, stop))
+            return
+        if kind == 'choice':
+            test = 'if'
+            for field in node[2]:
+                first = self._first(field[1])
+                lines.append('%s%s %s:' % (pad, test,
+                                           self._match(first, index, end)))
+                item = self._name('r')
+                self._decode(field[1], item, index, end, lines, depth + 1,
+                             True)
+                lines.append('%s    %s = (%r, %s)' % (pad, result, field[0],
+                                                      item))
+                test = 'elif'
+            lines.append('%selse:' % pad)
+            lines.append("%s    raise Error('ASN1 syntax error')" % pad)
+            return
+        if not matched:
+            lines.append('%sif not (%s):' % (pad, self._match([ident], index,
+                                                               end)))
+            lines.append("%s    raise Error('ASN1 syntax error')" % pad)
+        length = self._name('n')
+        lines.append('%s%s, %s = _length_at(data, %s + %d, %s)' % (
+            pad, length, index, index, len(ident), end))
+        if kind == 'primitive':
+            decode = _decoders.get((ClassUniversal, node[2]))
+            value = 'data[%s:%s + %s]' % (index, index, length)
+            if decode is None:
+                lines.append('%s%s = %s' % (pad, result, value))
+            else:
+                lines.append('%s%s = %s(%s)' % (pad, result,
+                                                self._constant(decode), value))
+            lines.append('%s%s += %s' % (pad, index, length))
+            return
+        inner, stop = self._name('i'), self._name('e')
+        lines.append('%s%s = %s' % (pad, inner, index))
+        lines.append('%s%s = %s + %s' % (pad, stop, index, length))
+        if kind == 'explicit':
+            self._decode(node[2], result, inner, stop, lines, depth)
+        elif kind == 'sequence of':
+            item = self._name('r')
+            lines.append('%s%s = []' % (pad, result))
+            lines.append('%swhile %s < %s:' % (pad, inner, stop))
+            self._decode(node[2], item, inner, stop, lines, depth + 1)
+            lines.append('%s    %s.append(%s)' % (pad, result, item))
+        elif kind == 'sequence':
+            lines.append('%s%s = {}' % (pad, result))
+            for name, child, optional, default in node[2]:
+                item = self._name('r')
+                if not optional:
+                    self._decode(child, item, inner, stop, lines, depth)
+                    lines.append('%s%s[%r] = %s' % (pad, result, name, item))
+                    continue
+                first = self._first(child)
+                lines.append('%sif %s:' % (pad, self._match(first, inner,
+                                                             stop)))
+                self._decode(child, item, inner, stop, lines, depth + 1,
+                             True)
+                lines.append('%s    %s[%r] = %s' % (pad, result, name, item))
+                lines.append('%selse:' % pad)
+                lines.append('%s    %s[%r] = %s' % (
+                    pad, result, name, self._constant(default)))
+        else:
+            lines.append('%s%s = {}' % (pad, result))
+            lines.append('%swhile %s < %s:' % (pad, inner, stop))
+            test = 'if'
+            for name, child, optional, default in node[2]:
+                first = self._first(child)
+                if first is None:
+                    raise Error('Untagged ANY in a SET')
+                lines.append('%s    %s %s:' % (pad, test,
+                                               self._match(first, inner,
+                                                           stop)))
+                item = self._name('r')
+                self._decode(child, item, inner, stop, lines, depth + 2,
+                             True)
+                lines.append('%s        %s[%r] = %s' % (pad, result, name,
+                                                        item))
+                test = 'elif'
+            lines.append('%s    else:' % pad)
+            lines.append("%s        raise Error('ASN1 syntax error')" % pad)
+            for name, child, optional, default in node[2]:
+                lines.append('%sif %r not in %s:' % (pad, name, result))
+                if optional:
+                    lines.append('%s    %s[%r] = %s' % (
+                        pad, result, name, self._constant(default)))
+                else:
+                    lines.append("%s    raise Error('ASN1 syntax error')"
+                                 % pad)
+        lines.append('%sif %s != %s:' % (pad, inner, stop))
+        lines.append("%s    raise Error('ASN1 syntax error')" % pad)
+        lines.append('%s%s = %s' % (pad, index, stop))
+
+
+async def _readexactly(reader, count):
+    """Read exactly `count` bytes from the stream `reader`."""
+    try:
+        return await reader.readexactly(count)
+    except EOFError:
+        raise Error('Premature end of input.')
+
+
+async def read_tlv(reader, max_length=1 << 24):
+    """Read one TLV record from the asyncio stream `reader`.
+
+    The header is read with as few reads as possible and the value with a
+    single readexactly(), so no byte beyond the record is consumed. Return
+    the encoded record as bytes, ready to be passed to Decoder.start(), or
+    None if the stream was at end of file. A record whose value is longer
+    than `max_length` bytes raises an Error before it is read; pass None
+    to allow any length.
+    """
+    try:
+        header = await reader.readexactly(2)
+    except EOFError as err:
+        if getattr(err, 'partial', None):
+            raise Error('Premature end of input.')
+        return None
+    dec = Decoder(max_length=max_length)
+    while True:
+        dec.start(header)
+        try:
+            dec._read_tag()
+            length = dec._read_length()
+        except _PrematureEnd as err:
+            header += await _readexactly(reader, err.missing)
+            continue
+        break
+    if length is None:
+        raise Error('Indefinite length not supported.')
+    if not length:
+        return header
+    return header + await _readexactly(reader, length)
+
+
+async def write_tlv(writer, data):
+    """Write the encoded record `data` to the asyncio stream `writer`, and
+    wait until it has been flushed."""
+    writer.write(data)
+    await writer.drain()